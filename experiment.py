@@ -3,8 +3,19 @@ import os
 import subprocess
 import time
 import json
+import mmap
 import atexit
+import copy
+import ctypes
+import hashlib
 import random
+import select
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+import traceback
 from datetime import datetime
 
 # Requires password-less sudo and ssh
@@ -16,11 +27,10 @@ BASE_DIR = os.getcwd()
 SDIR = "{}/shenango/".format(BASE_DIR)
 
 CLIENT_BIN = "{}/apps/synthetic/target/release/synthetic".format(SDIR)
-RSTAT = "{}/scripts/rstat.go".format(SDIR)
 
 THISHOST = subprocess.check_output("hostname -s", shell=True).strip()
 
-CORES_RESTRICT = True # Restrict cores on zig/zag
+CORES_RESTRICT = 8 # Only use this many cores of the NIC's node (None for all)
 
 binaries = {
     'iokerneld': {
@@ -56,13 +66,6 @@ binaries = {
     },
 }
 
-if CORES_RESTRICT:
-    USABLE_CPUS = range(0, 16, 2) + range(24, 40, 2)
-else:
-    USABLE_CPUS = range(0, 48, 2)
-
-USABLE_CPUS_STR = ",".join([str(x) for x in USABLE_CPUS])
-
 def IP(node):
     assert node > 0 and node < 255
     return "{}.{}".format(NETPFX, node)
@@ -90,14 +93,124 @@ SERVER_MACS = {
 }
 
 OBSERVER = "zig"
-OBSERVER_IP = IP(9)
-OBSERVER_MAC = SERVER_MACS['zig']
 CLIENT_SET = ["pd3", "pd4"]
-CLIENT_MACHINE_NCORES = 6
+CLIENT_POOL = sorted(h for h in OOB_IPS if h.startswith("pd"))
+CLIENT_MACHINE_NCORES = 6 # cap on client threads per machine (None for all)
 NEXT_CLIENT_ASSIGN = 0
 NIC_PCI = "0000:04:00.0"
 NIC_IFNAME = "enp4s0f0"
 
+############################# TOPOLOGY ###############################
+
+SYSFS_TOPOLOGY = [
+    "/sys/devices/system/cpu/online",
+    "/sys/devices/system/cpu/cpu*/topology/thread_siblings_list",
+    "/sys/devices/system/node/node*/cpulist",
+]
+
+def parse_cpulist(s):
+    # "0-3,8,10-11" -> [0, 1, 2, 3, 8, 10, 11]
+    cpus = []
+    for part in s.strip().split(","):
+        if part:
+            lo, _, hi = part.partition("-")
+            cpus += range(int(lo), int(hi or lo) + 1)
+    return cpus
+
+def sysfs_topology(host=None):
+    # path -> contents of the SYSFS_TOPOLOGY files, here or on host
+    cmd = "grep -H . {} 2>/dev/null || true".format(" ".join(SYSFS_TOPOLOGY))
+    if host:
+        cmd = "{} {} '{}'".format(SSH, host, cmd)
+    out = subprocess.check_output(cmd, shell=True)
+    return dict(line.split(":", 1) for line in out.splitlines())
+
+def cpu_topology(files):
+    # siblings: cpu -> its hyperthreads; nodes: node -> cpus; cores: node ->
+    # physical cores as sorted tuples of hyperthreads, ordered by first cpu
+    online = parse_cpulist(files["/sys/devices/system/cpu/online"])
+    siblings = {}
+    for cpu in online:
+        path = "/sys/devices/system/cpu/cpu{}/topology/thread_siblings_list".format(cpu)
+        siblings[cpu] = parse_cpulist(files.get(path, str(cpu)))
+    nodes = {}
+    for path, cpus in files.items():
+        if path.startswith("/sys/devices/system/node/node"):
+            node = int(path.split("/")[5][len("node"):])
+            nodes[node] = [c for c in parse_cpulist(cpus) if c in siblings]
+    if not nodes:
+        nodes = {0: online}
+    cores = {}
+    for node, cpus in nodes.items():
+        cores[node] = sorted(set(tuple(siblings[c]) for c in cpus))
+    return {'siblings': siblings, 'nodes': nodes, 'cores': cores}
+
+def nic_node(pci):
+    try:
+        with open("/sys/bus/pci/devices/{}/numa_node".format(pci)) as f:
+            return max(int(f.read()), 0)
+    except IOError:
+        return 0
+
+TOPOLOGY = cpu_topology(sysfs_topology())
+
+# Everything that touches the NIC (server threads, iokernel, swaptions and
+# IRQs) is kept on the NIC's node.
+NIC_NODE = nic_node(NIC_PCI)
+
+def node_cpus(nodes):
+    # the first CORES_RESTRICT cores of each node, all hyperthreads
+    return sorted(cpu for node in nodes
+                  for core in TOPOLOGY['cores'][node][:CORES_RESTRICT] for cpu in core)
+
+def numactl(nodes):
+    return "numactl -N {0} -m {0}".format(",".join(str(n) for n in nodes))
+
+USABLE_CPUS = node_cpus([NIC_NODE])
+NUMACTL = numactl([NIC_NODE])
+
+# Server apps may be placed on other nodes with 'numa_nodes' (Linux only);
+# apps without one share every node the experiment uses.
+def experiment_nodes(experiment):
+    # shared with the analysis; imported here since clients, which never
+    # place apps, need not have summary.py's numpy
+    import summary
+    return summary.experiment_nodes(experiment, NIC_NODE)
+
+def app_nodes(cfg, experiment):
+    return cfg.get('numa_nodes') or experiment_nodes(experiment)
+
+def place_servers(new_server, threads, experiment, numa, **kwargs):
+    # numa="span": one instance across every node; "per-node": one instance
+    # per node, each on its own port and so its own NIC queue
+    assert experiment['system'] == "linux"
+    nodes = sorted(TOPOLOGY['nodes'])
+    if numa == "span":
+        handle = new_server(threads, experiment, **kwargs)
+        handle['numa_nodes'] = nodes
+        return [handle]
+    assert numa == "per-node"
+    handles = []
+    for node in nodes:
+        handle = new_server(threads, experiment, **kwargs)
+        handle['name'] += "-n{}".format(node)
+        handle['numa_nodes'] = [node]
+        handles.append(handle)
+    return handles
+
+# host -> topology of client machines, probed over ssh on first use
+CLIENT_TOPOLOGY = {}
+
+def client_machine_ncores(host):
+    # hyperthreads on the client's first node, less the core its iokernel takes
+    if host not in CLIENT_TOPOLOGY:
+        CLIENT_TOPOLOGY[host] = cpu_topology(sysfs_topology(host))
+    topo = CLIENT_TOPOLOGY[host]
+    ncores = sum(len(core) for core in topo['cores'][min(topo['nodes'])][1:])
+    if CLIENT_MACHINE_NCORES:
+        ncores = min(ncores, CLIENT_MACHINE_NCORES)
+    return ncores
+
 def is_server():
     return THISHOST in SERVER_MACS.keys()
 
@@ -110,6 +223,9 @@ def new_experiment(system, **kwargs):
         'system': system,
         'clients': {},
         'server_hostname': THISHOST,
+        'observer': OBSERVER,
+        'nic_node': NIC_NODE,
+        'node_cpus': {str(n): len(cpus) for n, cpus in TOPOLOGY['nodes'].items()},
         'client_files': [__file__],
         'apps': [],
         'nextip': 100,
@@ -293,17 +409,15 @@ def new_measurement_instances(count, server_handle, mpps, experiment, mean=842,
     NEXT_CLIENT_ASSIGN += count
     return all_instances
 
-def sleep_5(cfg, experiment):
-    time.sleep(5)
-
 def finalize_measurement_cohort(experiment, samples, runtime):
     all_clients = [c for j in experiment['clients']
                    for c in experiment['clients'][j]]
     all_clients.sort(key=lambda c: c['host'])
     max_client_permachine = max(
         len(experiment['clients'][c]) for c in experiment['clients'])
-    assert max_client_permachine <= CLIENT_MACHINE_NCORES
-    threads_per_client = CLIENT_MACHINE_NCORES // max_client_permachine
+    ncores = min(client_machine_ncores(c) for c in experiment['clients'])
+    assert max_client_permachine <= ncores
+    threads_per_client = ncores // max_client_permachine
     assert threads_per_client % 2 == 0
     # Apps must have unique names
     assert len(set(app['name'] for app in experiment['apps'])) == len(experiment['apps'])
@@ -316,8 +430,6 @@ def finalize_measurement_cohort(experiment, samples, runtime):
         cfg['samples'] = samples
         cfg['leader'] = OOB_IPS[all_clients[0]
                                 ['host']] if i > 0 else cfg['host']
-        if i > 0:
-            cfg['before'] = ['sleep_5']
     experiment['client_files'].append(CLIENT_BIN)
 
 ########################## EXPERIMENTS ###############################
@@ -364,6 +476,97 @@ def loadshift(system, **kwargs):
     finalize_measurement_cohort(x, 0, 0)
     return x
 
+# Iterations of 'stridedmem:1024:7' per microsecond, as measured once on
+# the original zig/zag CPUs. Used when no calibration is available; the cpp
+# spin servers are always scaled from the rust rate by these ratios.
+FAKEWORK_DEFAULTS = {
+    ('rust', True): 83.89,
+    ('rust', False): 59.37,
+    ('cpp', True): 78.0,
+    ('cpp', False): 65.0,
+}
+
+# "<cpu model>|<sha256 of synthetic>|<ht or noht>" -> iterations per us
+FAKEWORK_CALIBRATION = "{}/fakework_calibration.json".format(BASE_DIR)
+# two request sizes; the rate is the slope between their median latencies,
+# which cancels the network, runtime and iokernel overhead in both
+CALIBRATION_ITERATIONS = (5000, 50000)
+
+def cpu_model():
+    with open("/proc/cpuinfo") as f:
+        for line in f:
+            if line.startswith("model name"):
+                return line.split(":", 1)[1].strip()
+    return "unknown"
+
+def load_calibration():
+    try:
+        with open(FAKEWORK_CALIBRATION) as f:
+            return json.loads(f.read())
+    except IOError:
+        return {}
+
+def calibration_key(noht):
+    binary = binaries['synthetic']['shenango'].split()[0]
+    if not os.access(binary, os.F_OK):
+        return None
+    return "{}|{}|{}".format(cpu_model(), artifact_hash(binary), "noht" if noht else "ht")
+
+def calibration_median(noht, iterations):
+    # Trickle constant-size requests through the local synthetic client
+    # and return their median latency in us.
+    x = assemble_local_synth(0.001, 1, 1, time=5, samples=1, noht=noht,
+                             distribution="constant", mean=iterations)
+    x['name'] += "-calibration-{}-{}".format("noht" if noht else "ht", iterations)
+    execute_experiment_noclients(x)
+    medians = []
+    with open("{}/localsynth.out".format(x['name'])) as f:
+        for line in f:
+            fields = line.split(",")
+            try:
+                medians.append(float(fields[5]))
+            except (IndexError, ValueError):
+                continue
+    assert medians, "no calibration sample in " + x['name']
+    return medians[-1]
+
+def calibrate_fakework(noht):
+    lo, hi = CALIBRATION_ITERATIONS
+    lo_us, hi_us = calibration_median(noht, lo), calibration_median(noht, hi)
+    assert hi_us > lo_us, "calibration latencies {} and {} us do not grow with work".format(lo_us, hi_us)
+    return (hi - lo) / (hi_us - lo_us)
+
+def calibrate_host():
+    # Measure the fakework rate for any mode this host and synthetic binary
+    # have not been calibrated in. Run before assembling experiments, since
+    # assembly only reads the cache.
+    assert is_server()
+    for noht in [True, False]:
+        key = calibration_key(noht)
+        if key is None or key in load_calibration():
+            continue
+        rate = calibrate_fakework(noht)
+        cal = load_calibration()
+        cal[key] = rate
+        with open(FAKEWORK_CALIBRATION + ".tmp", "w") as f:
+            f.write(json.dumps(cal, indent=2, sort_keys=True))
+        os.rename(FAKEWORK_CALIBRATION + ".tmp", FAKEWORK_CALIBRATION)
+        print "fakework calibration {}: {:.2f} iterations/us".format(key, rate)
+
+WARNED_UNCALIBRATED = set()
+
+def fakework_rate(noht):
+    # Calibrated iterations per us on this host from calibrate_host(); None
+    # (with a warning) when this CPU model / binary / mode has no entry.
+    key = calibration_key(noht)
+    cal = load_calibration()
+    if key in cal:
+        return cal[key]
+    if key not in WARNED_UNCALIBRATED:
+        WARNED_UNCALIBRATED.add(key)
+        print >>sys.stderr, "warning: no fakework calibration for {}; run calibrate_host() first. Using the zig/zag rates".format(key)
+    return None
+
 # for 'stridedmem:1024:7'
 def get_mean(target_us, system, noht):
     assert system in ["shenango", "linux", "arachne", "zygos", "linux-floating"]
@@ -376,17 +579,18 @@ def get_mean(target_us, system, noht):
         'linux-floating': 'cpp'
     }.get(system)
 
-    return int(float(target_us) * {
-        ('rust', True): 83.89,
-        ('rust', False): 59.37,
-        ('cpp', True): 78.0,
-        ('cpp', False): 65.0,
-    }.get((impl, noht)))
+    rate = fakework_rate(noht)
+    if rate is None:
+        return int(float(target_us) * FAKEWORK_DEFAULTS[(impl, noht)])
+    if impl == 'cpp':
+        rate *= FAKEWORK_DEFAULTS[('cpp', noht)] / FAKEWORK_DEFAULTS[('rust', noht)]
+    return int(float(target_us) * rate)
 
 
-def assemble_local_synth(mrps, producers, consumers, time=10, samples=20, **kwargs):
+def assemble_local_synth(mrps, producers, consumers, time=10, samples=20, noht=True, **kwargs):
     y = new_experiment("shenango")
-    y['noht'] = True
+    if noht:
+        y['noht'] = True
     x = {
         'ip': alloc_ip(y),
         'port': alloc_port(y),
@@ -402,7 +606,7 @@ def assemble_local_synth(mrps, producers, consumers, time=10, samples=20, **kwar
         'mpps': mrps,
         'protocol': 'synthetic',
         'distribution': kwargs.get('distribution', 'exponential'),
-        'mean': kwargs.get('mean', get_mean(10, "shenango", True)),
+        'mean': kwargs['mean'] if 'mean' in kwargs else get_mean(10, "shenango", noht),
         'client_threads': producers,
         'start_mpps': kwargs.get('start_mpps', 0),
         'args': "{ip}:{port} --rampup=0 --output={output} --protocol {protocol} --mode local-client --threads {client_threads} --runtime {runtime}  --mean={mean} --distribution={distribution} --mpps={mpps} --samples={samples} --start_mpps {start_mpps}"
@@ -411,7 +615,7 @@ def assemble_local_synth(mrps, producers, consumers, time=10, samples=20, **kwar
     y['apps'].append(x)
     return y
 
-def bench_memcached(system, thr, spin=False, bg=None, samples=55, time=10, mpps=6.0, noht=False, transport="tcp", nconns=1200, start_mpps=0.0):
+def bench_memcached(system, thr, spin=False, bg=None, samples=55, time=10, mpps=6.0, noht=False, transport="tcp", nconns=1200, start_mpps=0.0, numa=None):
     assert system in ["shenango", "linux", "arachne", "zygos"]
 
     x = new_experiment(system)
@@ -423,21 +627,28 @@ def bench_memcached(system, thr, spin=False, bg=None, samples=55, time=10, mpps=
         assert system == "shenango"
         x['noht'] = True
 
-    memcached_handle = new_memcached_server(thr, x, transport=transport)
-    if spin:
-        memcached_handle['spin'] = thr
+    if numa:
+        x['name'] += "-numa-" + numa
+        handles = place_servers(new_memcached_server, thr, x, numa, transport=transport)
+    else:
+        handles = [new_memcached_server(thr, x, transport=transport)]
+    for memcached_handle in handles:
+        if spin:
+            memcached_handle['spin'] = thr
 
     if bg == "swaptions":
-        new_swaptions_inst(len(USABLE_CPUS), x)
+        new_swaptions_inst(len(node_cpus(experiment_nodes(x))), x)
 
-    new_measurement_instances(len(CLIENT_SET), memcached_handle, mpps, x, nconns=nconns, start_mpps=start_mpps)
+    for memcached_handle in handles:
+        new_measurement_instances(max(1, len(CLIENT_SET) // len(handles)), memcached_handle, mpps / len(handles), x,
+                                  nconns=nconns // len(handles), start_mpps=start_mpps / len(handles))
     finalize_measurement_cohort(x, samples, time)
 
 
     return x
 
 
-def bench_dns(system, spin=False, bg=None, samples=54, time=10, mpps=5.4, noht=False, thr=None, **kwargs):
+def bench_dns(system, spin=False, bg=None, samples=54, time=10, mpps=5.4, noht=False, thr=None, numa=None, **kwargs):
     assert system in ["shenango", "linux"]
 
     x = new_experiment(system)
@@ -454,14 +665,21 @@ def bench_dns(system, spin=False, bg=None, samples=54, time=10, mpps=5.4, noht=F
         assert system == "shenango"
         x['noht'] = True
 
-    dns_handle = new_gdnsd_server(thr, x)
-    if spin:
-        dns_handle['spin'] = thr
+    if numa:
+        x['name'] += "-numa-" + numa
+        handles = place_servers(new_gdnsd_server, thr, x, numa)
+    else:
+        handles = [new_gdnsd_server(thr, x)]
+    for dns_handle in handles:
+        if spin:
+            dns_handle['spin'] = thr
 
     if bg == "swaptions":
-        new_swaptions_inst(len(USABLE_CPUS), x)
+        new_swaptions_inst(len(node_cpus(experiment_nodes(x))), x)
 
-    new_measurement_instances(len(CLIENT_SET), dns_handle, mpps, x, nconns=1200, warmup=False, **kwargs)
+    for dns_handle in handles:
+        new_measurement_instances(max(1, len(CLIENT_SET) // len(handles)), dns_handle, mpps / len(handles), x,
+                                  nconns=1200 // len(handles), warmup=False, **kwargs)
     finalize_measurement_cohort(x, samples, time)
 
     return x
@@ -478,30 +696,74 @@ def try_thr_memcached(system, thread_range, mpps_start, mpps_end, samples, trans
         finalize_measurement_cohort(x, samples, time)
         execute_experiment(x)
 
-def exitfn():
-    procs = ["iokerneld", "cstate", "memcached",
-             "swaptions", "mpstat", "synthetic", "gdnsd",
+# pkill patterns for the environment a session keeps warm, and for the
+# apps. The telemetry collector is a python process, so it is matched on
+# its command line (the brackets keep pkill's own shell from matching).
+ENV_PROCS = ["iokerneld", "cstate", "-f '[t]elemetry telemetry\\.'"]
+APP_PROCS = ["memcached", "swaptions", "synthetic", "gdnsd",
              "coreArbit", "ix", "spin-arachne", "spin-linux"]
+
+def exitfn(keep_env=False):
+    procs = APP_PROCS if keep_env else ENV_PROCS + APP_PROCS
     for j in procs:
         os.system("sudo pkill " + j)
     for j in procs:
         os.system("sudo pkill -9 " + j)
 
-    if is_server():
+    if is_server() and not keep_env:
         runcmd("sudo rmmod dune 2>/dev/null || true")
         runcmd("sudo rmmod pcidma 2>/dev/null || true")
 
-
-def switch_to_linux():
+def nic_driver():
+    try:
+        return os.path.basename(os.readlink("/sys/bus/pci/devices/{}/driver".format(NIC_PCI)))
+    except OSError:
+        return None
+
+def nic_steering(experiment, irq_cpus):
+    # ntuple rules (transport, port, src-port value, src-port mask, queue)
+    # for each single-node app of a multi-node experiment, spreading its
+    # flows over the queues of its node (the largest power of two of them)
+    # by the low bits of their source port. set_irq_affinity gives queue i to irq_cpus[i]. The mask has
+    # ethtool's sense (set bits are ignored) and is the same for every
+    # rule, as ixgbe's flow director only has one.
+    if not experiment or len(experiment_nodes(experiment)) < 2:
+        return []
+    apps = [app for app in experiment['apps']
+            if app['port'] and len(app.get('numa_nodes', [])) == 1]
+    queues = {}
+    for app in apps:
+        cpus = set(node_cpus(app['numa_nodes']))
+        queues[app['name']] = [i for i, cpu in enumerate(irq_cpus) if cpu in cpus]
+    bits = 0
+    while apps and 2 << bits <= min(len(q) for q in queues.values()):
+        bits += 1
+    mask = 0xffff ^ ((1 << bits) - 1)
+    return [(app.get('transport', 'tcp'), app['port'], v, mask, queues[app['name']][v])
+            for app in apps for v in range(1 << bits)]
+
+
+def switch_to_linux(experiment=None):
     assert is_server()
     print "switch to linux"
-    runcmd("sudo ifdown {} || true".format(NIC_IFNAME))
+    irq_cpus = node_cpus(experiment_nodes(experiment)) if experiment else USABLE_CPUS
     runcmd("sudo {}/scripts/setup_machine.sh || true".format(SDIR))
-    runcmd("sudo {}/dpdk/usertools/dpdk-devbind.py -b none {}".format(SDIR, NIC_PCI))
-    runcmd("sudo modprobe ixgbe")
-    runcmd("sudo {}/dpdk/usertools/dpdk-devbind.py -b ixgbe {}".format(SDIR, NIC_PCI))
+    if nic_driver() != "ixgbe":
+        runcmd("sudo ifdown {} || true".format(NIC_IFNAME))
+        runcmd("sudo {}/dpdk/usertools/dpdk-devbind.py -b none {}".format(SDIR, NIC_PCI))
+        runcmd("sudo modprobe ixgbe")
+        runcmd("sudo {}/dpdk/usertools/dpdk-devbind.py -b ixgbe {}".format(SDIR, NIC_PCI))
     runcmd("sudo ethtool -N {} rx-flow-hash udp4 sdfn".format(NIC_IFNAME))
-    runcmd("sudo {}/scripts/set_irq_affinity {} {}".format(SDIR, USABLE_CPUS_STR, NIC_IFNAME))
+    runcmd("sudo {}/scripts/set_irq_affinity {} {}".format(SDIR, ",".join(str(c) for c in irq_cpus), NIC_IFNAME))
+    # steer each single-node app's port to the queues on its own node
+    # (toggling ntuple drops old rules)
+    runcmd("sudo ethtool -K {} ntuple off || true".format(NIC_IFNAME))
+    steering = nic_steering(experiment, irq_cpus)
+    if steering:
+        runcmd("sudo ethtool -K {} ntuple on".format(NIC_IFNAME))
+        for transport, port, src, mask, queue in steering:
+            runcmd("sudo ethtool -N {} flow-type {}4 dst-port {} src-port {} m {:#x} action {}".format(
+                NIC_IFNAME, transport, port, src, mask, queue))
     runcmd("sudo ip addr flush {}".format(NIC_IFNAME))
     runcmd("sudo ip addr add {}/24 dev {}".format(LNX_IPS[THISHOST], NIC_IFNAME))
     runcmd("sudo sysctl net.ipv4.tcp_syncookies=1")
@@ -510,7 +772,7 @@ def switch_to_linux():
 
 def switch_to_shenango():
     runcmd("sudo {}/scripts/setup_machine.sh || true".format(SDIR))
-    if not is_server():
+    if not is_server() or nic_driver() == "igb_uio":
         return
     runcmd("sudo ifdown {}".format(NIC_IFNAME))
     runcmd("sudo modprobe uio")
@@ -538,31 +800,156 @@ def runcmd(cmdstr, **kwargs):
     return subprocess.check_output(cmdstr, shell=True, **kwargs)
 
 
+# Every ssh/scp/rsync reuses one persistent, multiplexed connection per
+# host, opened by the first call to that host and closed at exit.
+SSH_OPTS = "-o ControlMaster=auto -o ControlPath=/tmp/ssh-shenango-%C -o ControlPersist=yes"
+SSH = "ssh " + SSH_OPTS
+SCP = "scp " + SSH_OPTS
+RSYNC = "rsync -e '{}'".format(SSH)
+
+# (experiment, unix time, host, command kind, seconds) for every remote
+# call, counted towards the experiment the calling thread is running
+REMOTE_CALLS = []
+REMOTE_HOSTS = set()
+REMOTE_TAG = threading.local()
+
+def close_ssh_pool():
+    for host in REMOTE_HOSTS:
+        os.system("ssh -O exit -o ControlPath=/tmp/ssh-shenango-%C {} 2>/dev/null".format(host))
+
+def record_remote_call(start, host, kind, secs):
+    REMOTE_CALLS.append((getattr(REMOTE_TAG, 'experiment', None), start, host, kind, secs))
+    REMOTE_HOSTS.add(host)
+
+def tagged_thread(target, *args):
+    # a thread whose remote calls count towards the caller's experiment
+    tag = getattr(REMOTE_TAG, 'experiment', None)
+    def run():
+        REMOTE_TAG.experiment = tag
+        target(*args)
+    return threading.Thread(target=run)
+
+def remote_call_stats(experiment_name):
+    # {(host, kind): count, total, mean and max seconds} of the remote
+    # calls made for an experiment
+    stats = {}
+    for tag, tm, host, kind, secs in REMOTE_CALLS:
+        if tag != experiment_name:
+            continue
+        st = stats.setdefault((host, kind), {'calls': 0, 'total': 0.0, 'max': 0.0})
+        st['calls'] += 1
+        st['total'] += secs
+        st['max'] = max(st['max'], secs)
+    for st in stats.values():
+        st['mean'] = st['total'] / st['calls']
+    return stats
+
 def runpara(cmd, inputs, die_on_failure=False, **kwargs):
     fail = "--halt now,fail=1" if die_on_failure else ""
-    return runcmd("parallel {} \"{}\" ::: {}".format(fail, cmd, " ".join(inputs)))
+    fd, joblog = tempfile.mkstemp(prefix="parallel.")
+    os.close(fd)
+    try:
+        return runcmd("parallel --joblog {} {} \"{}\" ::: {}".format(joblog, fail, cmd, " ".join(inputs)))
+    finally:
+        # joblog: Seq Host Starttime JobRuntime Send Receive Exitval Signal Command
+        kind = cmd.split()[0]
+        with open(joblog) as f:
+            for line in f.readlines()[1:]:
+                fields = line.split("\t")
+                record_remote_call(float(fields[2]), inputs[int(fields[0]) - 1],
+                                   kind, float(fields[3]))
+        os.unlink(joblog)
 
 
 def runremote(cmd, hosts, **kwargs):
-    return runpara("ssh -t -t {{}} '{cmd}'".format(cmd=cmd), hosts, kwargs)
+    return runpara("{ssh} -t -t {{}} '{cmd}'".format(ssh=SSH, cmd=cmd), hosts, **kwargs)
 
 ############################# APPLICATIONS ###########################
 
+# Readiness probes
+
+# experiment name -> [(stage, confirmed, start time)...] for stages
+# started on this host
+STARTUP_STAGES = {}
+
+# An app that could not be confirmed ready gets this many seconds from its
+# launch to settle before the clients start.
+SETTLE_SECS = 10
+
+# logged by the shenango runtime once it has registered with the iokernel
+# and set up its network stack, just before it starts the app's main thread
+RUNTIME_READY_MARKER = "init: spawning"
+
+def port_listening(port, transport="tcp"):
+    # Is a local socket bound to port? TCP sockets must be in LISTEN (0A).
+    for fn in ["/proc/net/{}".format(transport), "/proc/net/{}6".format(transport)]:
+        try:
+            with open(fn) as f:
+                lines = f.readlines()[1:]
+        except IOError:
+            continue
+        for line in lines:
+            fields = line.split()
+            if int(fields[1].rsplit(":", 1)[1], 16) != port:
+                continue
+            if transport == "udp" or fields[3] == "0A":
+                return True
+    return False
+
+def file_nonempty(fname):
+    try:
+        with open(fname) as f:
+            return f.read().strip() != ""
+    except IOError:
+        return False
+
+def log_contains(fname, marker):
+    try:
+        with open(fname) as f:
+            return marker in f.read()
+    except IOError:
+        return False
+
+def wait_ready(stage, proc, experiment, probe=None, timeout=10):
+    # Poll probe() until it returns True, failing if proc exits first. With
+    # no probe, or if the probe never fires, the stage is assumed to be up
+    # once proc has stayed alive for timeout seconds, as the fixed sleeps
+    # used to. The time taken is appended to startup.<host>.log.
+    start = time.time()
+    confirmed = False
+    while True:
+        proc.poll()
+        assert proc.returncode is None, "{} exited during startup".format(stage)
+        if probe and probe():
+            confirmed = True
+            break
+        if time.time() - start >= timeout:
+            break
+        time.sleep(0.05)
+    elapsed = time.time() - start
+    if probe and not confirmed:
+        print "{} not confirmed ready after {}s, continuing".format(stage, timeout)
+    STARTUP_STAGES.setdefault(experiment['name'], []).append((stage, confirmed, start))
+    with open("{}/startup.{}.log".format(experiment['name'], THISHOST), "a") as f:
+        f.write("{} {} {:.3f} {}\n".format(int(time.time()), stage, elapsed,
+                                           "ready" if confirmed else "assumed"))
+    return confirmed
+
 # Launching configuration spec
 
 
-def start_iokerneld(experiment):
+def start_iokerneld(experiment, logdir=None):
+    logdir = logdir or experiment['name']
     switch_to_shenango()
     binary = binaries['iokerneld']['ht']
     if 'noht' in experiment and THISHOST == experiment['server_hostname']:
         binary = binaries['iokerneld']['noht']
     runcmd("sudo {}/scripts/setup_machine.sh || true".format(SDIR))
     proc = subprocess.Popen("sudo {} 2>&1 | ts %s > iokernel.{}.log".format(
-        binary, THISHOST), shell=True, cwd=experiment['name'])
-    time.sleep(10)
-    proc.poll()
-
-    assert proc.returncode is None
+        variant_path(experiment, binary), THISHOST), shell=True, cwd=logdir)
+    log = "{}/iokernel.{}.log".format(logdir, THISHOST)
+    wait_ready("iokerneld", proc, experiment,
+               probe=lambda: log_contains(log, "running dataplane"))
     return proc
 
 def start_corearbiter(experiment):
@@ -570,11 +957,12 @@ def start_corearbiter(experiment):
     assert is_server()
     assert not 'noht' in experiment
     runcmd("sudo {}/scripts/setup_machine.sh || true".format(SDIR))
-    proc = subprocess.Popen("sudo numactl -N 0 -m 0 {} > corearbiter.{}.log 2>&1".format(
-      binary, THISHOST), shell=True, cwd=experiment['name'])
-    time.sleep(5)
-    proc.poll()
-    assert proc.returncode is None
+    # a socket left by an earlier run would satisfy the probe at once
+    runcmd("sudo rm -f /tmp/CoreArbiter/socket")
+    proc = subprocess.Popen("sudo {} {} > corearbiter.{}.log 2>&1".format(
+      NUMACTL, binary, THISHOST), shell=True, cwd=experiment['name'])
+    wait_ready("corearbiter", proc, experiment, timeout=5,
+               probe=lambda: os.path.exists("/tmp/CoreArbiter/socket"))
     return proc
 
 def start_cstate():
@@ -613,8 +1001,9 @@ def gen_conf(filename, experiment, mac=None, **kwargs):
                 continue
             conf.append("static_arp {ip} {mac}".format(**cfg))
 
-    if OBSERVER:
-      conf.append("static_arp {} {}".format(OBSERVER_IP, OBSERVER_MAC))
+    observer = experiment.get('observer', OBSERVER)
+    if observer:
+      conf.append("static_arp {} {}".format(LNX_IPS[observer], SERVER_MACS[observer]))
 
     with open(filename, "w") as f:
         f.write("\n".join(conf).format(
@@ -631,13 +1020,13 @@ def gen_ix_conf(filename, experiment, **kwargs):
         "loader_path=\"/lib64/ld-linux-x86-64.so.2\"",
     ]
 
-    # ZIG/ZAG SPECIFIC! #
-    assert THISHOST in ["zig", "zag"]
-
+    # one hyperthread per core of the NIC's node, or both hyperthreads of
+    # each core in turn
+    cores = TOPOLOGY['cores'][NIC_NODE]
     if 'noht' in experiment:
-        cpu_list = list(range(0,24,2))
+        cpu_list = [core[0] for core in cores]
     else:
-        cpu_list = [core for pair in zip(range(0,24,2), range(24,48,2)) for core in pair]
+        cpu_list = [cpu for core in cores for cpu in core]
 
     cpus = sorted(cpu_list[:kwargs['threads']])
 
@@ -659,21 +1048,18 @@ def launch_shenango_program(cfg, experiment):
     assert 'args' in cfg
 
     if not 'binary' in cfg:
-        cfg['binary'] = binaries[cfg['app']]['shenango']
+        cfg['binary'] = variant_path(experiment, binaries[cfg['app']]['shenango'])
 
-    cwd = os.getcwd()
-    os.chdir(experiment['name'])
-    assert os.access(cfg['binary'].split()[0], os.F_OK), cfg[
+    assert os.access(os.path.join(experiment['name'], cfg['binary'].split()[0]), os.F_OK), cfg[
         'binary'].split()[0]
-    os.chdir(cwd)
 
     gen_conf(
         "{}/{}.config".format(experiment['name'], cfg['name']), experiment, **cfg)
 
     args = cfg['args'].format(**cfg)
 
-    fullcmd = "numactl -N 0 -m 0 {bin} {name}.config {args} > {name}.out 2> {name}.err"
-    fullcmd = fullcmd.format(bin=cfg['binary'], name=cfg['name'], args=args)
+    fullcmd = "{numactl} {bin} {name}.config {args} > {name}.out 2> {name}.err"
+    fullcmd = fullcmd.format(numactl=NUMACTL, bin=cfg['binary'], name=cfg['name'], args=args)
     print "Running", fullcmd
 
     ### HACK
@@ -681,9 +1067,11 @@ def launch_shenango_program(cfg, experiment):
     #     fullcmd = "export RUST_BACKTRACE=1; " + fullcmd
 
     proc = subprocess.Popen(fullcmd, shell=True, cwd=experiment['name'])
-    time.sleep(3)
-    proc.poll()
-    assert not proc.returncode
+    # the runtime's sockets are not visible to the kernel, so wait for its
+    # own log line instead
+    logs = ["{}/{}.{}".format(experiment['name'], cfg['name'], ext) for ext in ["out", "err"]]
+    wait_ready(cfg['name'], proc, experiment, timeout=3,
+               probe=lambda: any(log_contains(log, RUNTIME_READY_MARKER) for log in logs))
     return proc
 
 def launch_zygos_program(cfg, experiment):
@@ -692,11 +1080,8 @@ def launch_zygos_program(cfg, experiment):
     if not 'binary' in cfg:
         cfg['binary'] = binaries[cfg['app']]['zygos']
 
-    cwd = os.getcwd()
-    os.chdir(experiment['name'])
-    assert os.access(cfg['binary'].split()[0], os.F_OK), cfg[
+    assert os.access(os.path.join(experiment['name'], cfg['binary'].split()[0]), os.F_OK), cfg[
         'binary'].split()[0]
-    os.chdir(cwd)
 
     prio = ""
     if cfg['nice'] >= 0:
@@ -709,14 +1094,14 @@ def launch_zygos_program(cfg, experiment):
     args = cfg['args'].format(**cfg)
 
     ix = "{}/zygos/dp/ix".format(BASE_DIR)
-    fullcmd = "sudo numactl -N 0 -m 0 {prio} {ix} -c {cnf} -- {bin} {args} > {name}.out 2>&1"
-    fullcmd = fullcmd.format(prio=prio, ix=ix, bin=cfg['binary'], name=cfg['name'], cnf=os.path.abspath(cnf_name), args=args)
+    fullcmd = "sudo {numactl} {prio} {ix} -c {cnf} -- {bin} {args} > {name}.out 2>&1"
+    fullcmd = fullcmd.format(numactl=NUMACTL, prio=prio, ix=ix, bin=cfg['binary'], name=cfg['name'], cnf=os.path.abspath(cnf_name), args=args)
     print "Running", fullcmd
 
     proc = subprocess.Popen(fullcmd, shell=True, cwd=experiment['name'])
-    time.sleep(20)
-    proc.poll()
-    assert proc.returncode is None
+    # IX's dataplane has the NIC and gives no readiness signal that can be
+    # probed from here, so the app only gets a survival window
+    wait_ready(cfg['name'], proc, experiment, timeout=20)
     return proc
 
 
@@ -738,18 +1123,24 @@ def launch_linux_program(cfg, experiment):
 
     # cpu_list = [str(i) for a in range(0, 24, 2) for i in [a, a + 24]]
     # assert cfg['threads'] <= len(cpu_list)
-    cpu_bind = "-C " + USABLE_CPUS_STR #-C " + ",".join(cpu_list[:cfg['threads']])
+    nodes = app_nodes(cfg, experiment)
+    cpu_bind = "-C " + ",".join(str(c) for c in node_cpus(nodes)) #-C " + ",".join(cpu_list[:cfg['threads']])
 
-    fullcmd = "numactl -N 0 -m 0 {bind} {prio} {bin} {args} > {name}.out 2>&1"
-    fullcmd = fullcmd.format(bind=cpu_bind, bin=binary,
+    fullcmd = "{numactl} {bind} {prio} {bin} {args} > {name}.out 2>&1"
+    fullcmd = fullcmd.format(numactl=numactl(nodes), bind=cpu_bind, bin=binary,
                              name=name, args=args, prio=prio)
     print "Running", fullcmd
     proc = subprocess.Popen(fullcmd, shell=True, cwd=experiment['name'])
 
+    if cfg['port']:
+        wait_ready(cfg['name'], proc, experiment,
+                   probe=lambda: port_listening(cfg['port'], cfg.get('transport', 'tcp')))
+
     if cfg['nice'] < 0:
-        time.sleep(2)
-        pid = proc.pid
-        with open("/proc/{pid}/task/{pid}/children".format(pid=pid)) as f:
+        children = "/proc/{pid}/task/{pid}/children".format(pid=proc.pid)
+        wait_ready(cfg['name'] + "-threads", proc, experiment, timeout=2,
+                   probe=lambda: file_nonempty(children))
+        with open(children) as f:
             for line in f:
                 runcmd(
                     "sudo renice -n {} -p $(ls /proc/{}/task)".format(cfg['nice'], line.strip()))
@@ -773,12 +1164,16 @@ def launch_arachne_program(cfg, experiment):
         #prio = "nice -n {}".format(cfg['nice'])
 
     args = cfg['args'].format(**cfg)
-    fullcmd = "numactl -N 0 -m 0 {prio} {bin} {args} > {name}.out 2>&1"
-    fullcmd = fullcmd.format(bin=binary, prio=prio,
+    fullcmd = "{numactl} {prio} {bin} {args} > {name}.out 2>&1"
+    fullcmd = fullcmd.format(numactl=NUMACTL, bin=binary, prio=prio,
                              name=name, args=args)
     print "Running", fullcmd
     proc = subprocess.Popen(fullcmd, shell=True, cwd=experiment['name'])
 
+    if cfg['port']:
+        wait_ready(cfg['name'], proc, experiment,
+                   probe=lambda: port_listening(cfg['port'], cfg.get('transport', 'tcp')))
+
     proc.poll()
     assert proc.returncode is None
     return proc
@@ -818,6 +1213,100 @@ def go_client(experiment_directory):
         p.wait()
     return
 
+# Telemetry: per-core /proc/stat samples in a binary ring file. The file is
+# TELEMETRY_HEADER, then (cpu id, node) uint16 pairs for each cpu, padded to
+# 8 bytes, then `capacity` records of: monotonic ns, context switches,
+# softirqs and (busy, idle) jiffies per cpu, as uint32. Record i is in slot
+# i % capacity and the header's last field counts the records written.
+TELEMETRY_MAGIC = "SHTLM001"
+# magic, ncpus, capacity, interval us, anchor monotonic ns, anchor wall ns, records
+TELEMETRY_HEADER = struct.Struct("<8sIIIqqQ")
+TELEMETRY_INTERVAL_MS = 10
+TELEMETRY_CAPACITY = 1 << 18
+
+LIBC = ctypes.CDLL("libc.so.6", use_errno=True)
+CLOCK_MONOTONIC = 1
+
+def monotonic_ns():
+    ts = (ctypes.c_long * 2)()
+    if LIBC.clock_gettime(CLOCK_MONOTONIC, ts) != 0:
+        raise OSError(ctypes.get_errno(), "clock_gettime")
+    return ts[0] * 1000000000 + ts[1]
+
+def read_proc_stat():
+    # -> ({cpu: (busy, idle) jiffies}, context switches, softirqs); as for
+    # mpstat's %idle, iowait counts as busy
+    cpus = {}
+    ctxt = softirq = 0
+    with open("/proc/stat") as f:
+        for line in f:
+            fields = line.split()
+            if fields[0].startswith("cpu") and fields[0] != "cpu":
+                vals = [int(v) for v in fields[1:9]]
+                cpus[int(fields[0][3:])] = (sum(vals) - vals[3], vals[3])
+            elif fields[0] == "ctxt":
+                ctxt = int(fields[1])
+            elif fields[0] == "softirq":
+                softirq = int(fields[1])
+    return cpus, ctxt, softirq
+
+def go_telemetry(fname, interval_ms=TELEMETRY_INTERVAL_MS, capacity=TELEMETRY_CAPACITY):
+    cpus, _, _ = read_proc_stat()
+    ids = sorted(cpus)
+    node_of = {cpu: node for node, node_cpus in TOPOLOGY['nodes'].items() for cpu in node_cpus}
+    cpu_table = struct.pack("<" + "H" * 2 * len(ids),
+                            *[v for cpu in ids for v in (cpu, node_of.get(cpu, 0))])
+    data_start = (TELEMETRY_HEADER.size + len(cpu_table) + 7) // 8 * 8
+    record = struct.Struct("<qQQ" + "II" * len(ids))
+    size = data_start + capacity * record.size
+
+    # anchor the monotonic clock to wall time at the middle of the read
+    t0 = monotonic_ns()
+    wall = time.time()
+    t1 = monotonic_ns()
+    with open(fname, "w+b") as f:
+        f.truncate(size)
+        buf = mmap.mmap(f.fileno(), size)
+    TELEMETRY_HEADER.pack_into(buf, 0, TELEMETRY_MAGIC, len(ids), capacity,
+                               int(interval_ms * 1000), (t0 + t1) // 2, int(wall * 1e9), 0)
+    buf[TELEMETRY_HEADER.size:TELEMETRY_HEADER.size + len(cpu_table)] = cpu_table
+
+    interval_ns = int(interval_ms * 1e6)
+    deadline = monotonic_ns()
+    n = 0
+    while True:
+        now = monotonic_ns()
+        cpus, ctxt, softirq = read_proc_stat()
+        vals = [v & 0xffffffff for cpu in ids for v in cpus.get(cpu, (0, 0))]
+        record.pack_into(buf, data_start + (n % capacity) * record.size,
+                         now, ctxt, softirq, *vals)
+        n += 1
+        struct.pack_into("<Q", buf, TELEMETRY_HEADER.size - 8, n)
+        deadline += interval_ns
+        delay = deadline - monotonic_ns()
+        if delay > 0:
+            time.sleep(delay / 1e9)
+        else:
+            # fell behind; skip the missed slots rather than bursting
+            deadline = monotonic_ns()
+
+# Runtime stats: every shenango runtime answers a UDP datagram holding
+# RSTAT_MAGIC on RSTAT_PORT with its counters as "name:value,...". The
+# observer polls them all from one socket on a shared timer and appends one
+# {"time": poll time, "stats": {name: {counter: value}}} line per poll to
+# rstat.jsonl; summary.py derives the rstat fields from counter deltas.
+RSTAT_MAGIC = struct.pack("<Q", 0xDEADBEEF)
+RSTAT_PORT = 40
+RSTAT_INTERVAL = 1.0
+
+def parse_rstat_reply(data):
+    counters = {}
+    for pair in data.strip("\0\n,").split(","):
+        name, _, value = pair.partition(":")
+        if value:
+            counters[name] = int(value)
+    return counters
+
 def go_observer(experiment_directory):
     assert os.access(experiment_directory, os.F_OK)
     with open(experiment_directory + "/config.json") as f:
@@ -826,16 +1315,197 @@ def go_observer(experiment_directory):
     if experiment['system'] != "shenango":
         return
 
-    procs = []
+    names = {}
     for app in experiment['apps'] + [app for client in experiment['clients'] for app in experiment['clients'][client]]:
-        fullcmd = "sudo arp -d {ip} || true; "
-        fullcmd += "go run rstat.go {ip} 1 "
-        fullcmd += "| ts %s > rstat.{name}.log"
-        procs.append(subprocess.Popen(fullcmd.format(**app), shell=True,cwd=experiment['name']))
+        names.setdefault(app['ip'], []).append(app['name'])
+    port = experiment.get('rstat_port', RSTAT_PORT)
+    interval = experiment.get('rstat_interval', RSTAT_INTERVAL)
+    subprocess.call("; ".join("sudo arp -d {} || true".format(ip) for ip in names), shell=True)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(0)
+    with open(experiment_directory + "/rstat.jsonl", "a") as out:
+        deadline = time.time()
+        while True:
+            # drop replies that missed the previous poll
+            while select.select([sock], [], [], 0)[0]:
+                sock.recv(65536)
+            now = time.time()
+            for ip in names:
+                try:
+                    sock.sendto(RSTAT_MAGIC, (ip, port))
+                except socket.error:
+                    pass # not up yet, or gone
+            deadline += interval
+            stats = {}
+            while len(stats) < len(names):
+                ready = select.select([sock], [], [], max(deadline - time.time(), 0))[0]
+                if not ready:
+                    break
+                try:
+                    data, (ip, _) = sock.recvfrom(65536)
+                except socket.error:
+                    continue
+                if ip in names:
+                    stats[ip] = parse_rstat_reply(data)
+            out.write(json.dumps({'time': now, 'stats': {
+                name: counters for ip, counters in stats.items() for name in names[ip]}}) + "\n")
+            out.flush()
+            delay = deadline - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                deadline = time.time()
+
+
+def telemetry_count(fname):
+    # records written so far to a telemetry file
+    with open(fname, "rb") as f:
+        return TELEMETRY_HEADER.unpack(f.read(TELEMETRY_HEADER.size))[-1]
+
+def copy_telemetry(src, dst, since=0):
+    # Copy the records src gained after its first `since` into dst as a ring
+    # holding exactly those records, oldest first. The live ring is sparse
+    # and sized for a long session; copies only carry what a run wrote.
+    with open(src, "rb") as f:
+        magic, ncpus, capacity, interval_us, anchor_mono, anchor_wall, count = \
+            TELEMETRY_HEADER.unpack(f.read(TELEMETRY_HEADER.size))
+        table = f.read(4 * ncpus)
+        data_start = (TELEMETRY_HEADER.size + len(table) + 7) // 8 * 8
+        rsize = struct.calcsize("<qQQ" + "II" * ncpus)
+        first = min(max(since, count - capacity), count)
+        with open(dst + ".tmp", "wb") as out:
+            out.write(TELEMETRY_HEADER.pack(magic, ncpus, count - first, interval_us,
+                                            anchor_mono, anchor_wall, count - first))
+            out.write(table)
+            out.write("\0" * (data_start - TELEMETRY_HEADER.size - len(table)))
+            i = first
+            while i < count:
+                slot = i % capacity
+                n = min(count - i, capacity - slot)
+                f.seek(data_start + slot * rsize)
+                out.write(f.read(n * rsize))
+                i += n
+    os.rename(dst + ".tmp", dst)
+
+def telemetry_cpu(experiment):
+    # A cpu on a core the experiment leaves alone, preferably on another
+    # node, so that sampling /proc/stat neither takes cycles from the apps
+    # nor shows up in their utilization; None if every core is in use.
+    used = set(node_cpus(experiment_nodes(experiment)))
+    nodes = set(experiment_nodes(experiment))
+    spare = [(node not in nodes, cpu) for node, cpus in TOPOLOGY['nodes'].items()
+             for cpu in cpus if cpu not in used]
+    return max(spare)[1] if spare else None
+
+def start_environment_procs(experiment, logdir):
+    procs = []
 
-    for p in procs:
-        p.wait()
+    # Start per-core telemetry
+    cpu = telemetry_cpu(experiment)
+    if cpu is None:
+        print "warning: no spare cpu for telemetry, leaving it unpinned"
+    pin = ["taskset", "-c", str(cpu)] if cpu is not None else []
+    procs.append(subprocess.Popen(pin + ["python", os.path.abspath(__file__), "telemetry",
+                                         "telemetry.{}.bin".format(THISHOST),
+                                         str(experiment.get('telemetry_ms', TELEMETRY_INTERVAL_MS))],
+                                  cwd=logdir))
 
+    # Start cstate
+    procs.append(start_cstate())
+
+    # Run iokernel or dune
+    if experiment['system'] == "shenango":
+        procs.append(start_iokerneld(experiment, logdir))
+    elif experiment['system'] == "zygos":
+        switch_to_zygos()
+    else:
+        switch_to_linux(experiment)
+    return procs
+
+# Sessions: back-to-back experiments on this host share one warm
+# environment (NIC mode, telemetry, cstate and iokerneld) for as long as
+# they need the same one. Only the apps are restarted between runs, and
+# each run gets its slice of the session's logs.
+SESSION = None
+
+def environment_key(experiment):
+    irq_cpus = node_cpus(experiment_nodes(experiment))
+    return json.dumps([experiment['system'], 'noht' in experiment, experiment.get('sdir'),
+                       experiment.get('telemetry_ms', TELEMETRY_INTERVAL_MS),
+                       irq_cpus, nic_steering(experiment, irq_cpus)])
+
+def stop_environment():
+    for p in SESSION['procs']:
+        p.terminate()
+        p.wait()
+    SESSION['procs'] = []
+    SESSION['key'] = None
+    exitfn()
+    # the next environment starts its logs afresh
+    for f in os.listdir(SESSION['dir']):
+        os.unlink("{}/{}".format(SESSION['dir'], f))
+
+def start_environment(experiment):
+    # -> the environment processes this run owns (none in a session)
+    if SESSION is None:
+        return start_environment_procs(experiment, experiment['name'])
+    key = environment_key(experiment)
+    if (SESSION['key'] != key or SESSION['driver'] != nic_driver() or
+            any(p.poll() is not None for p in SESSION['procs'])):
+        if SESSION['key']:
+            stop_environment()
+        SESSION['procs'] = start_environment_procs(experiment, SESSION['dir'])
+        SESSION['key'] = key
+        SESSION['driver'] = nic_driver()
+        SESSION['offsets'] = {}
+    else:
+        print "reusing warm environment"
+        # where this run's part of each session file starts: a record
+        # count for telemetry rings, a byte offset for everything else
+        SESSION['offsets'] = {}
+        for f in os.listdir(SESSION['dir']):
+            path = "{}/{}".format(SESSION['dir'], f)
+            if f.startswith("telemetry."):
+                SESSION['offsets'][f] = telemetry_count(path)
+            else:
+                SESSION['offsets'][f] = os.path.getsize(path)
+    return []
+
+def finish_environment(experiment):
+    # copy this run's part of the session files into its directory; a run
+    # with its own environment only trims its telemetry ring
+    if SESSION is None:
+        tel = "{}/telemetry.{}.bin".format(experiment['name'], THISHOST)
+        if os.access(tel, os.F_OK):
+            copy_telemetry(tel, tel)
+        return
+    for f in os.listdir(SESSION['dir']):
+        src = "{}/{}".format(SESSION['dir'], f)
+        dst = "{}/{}".format(experiment['name'], f)
+        if f.startswith("telemetry."):
+            copy_telemetry(src, dst, SESSION['offsets'].get(f, 0))
+        else:
+            with open(src, "rb") as fin, open(dst, "wb") as fout:
+                fin.seek(SESSION['offsets'].get(f, 0))
+                shutil.copyfileobj(fin, fout)
+
+def run_session(experiments):
+    # Run experiments back to back on this host without tearing down the
+    # environment between runs that can share it.
+    global SESSION
+    SESSION = {'key': None, 'driver': None, 'procs': [], 'offsets': {},
+               'dir': tempfile.mkdtemp(prefix=".session.", dir=BASE_DIR)}
+    try:
+        for x in experiments:
+            if x['clients']:
+                execute_experiment(x)
+            else:
+                execute_experiment_noclients(x)
+    finally:
+        stop_environment()
+        shutil.rmtree(SESSION['dir'])
+        SESSION = None
 
 def go_server(experiment):
     procs = []
@@ -845,31 +1515,25 @@ def go_server(experiment):
         os.mkdir(experiment['name'])
     except:
         pass
-    # Copy ourselves for posterity
-    runcmd("cp {} {}/".format(__file__, experiment['name']))
+    # Copy ourselves for posterity (unless we are already that copy)
+    if os.path.dirname(os.path.abspath(__file__)) != os.path.abspath(experiment['name']):
+        runcmd("cp {} {}/".format(__file__, experiment['name']))
 
     conf_fn = experiment['name'] + "/config.json"
     with open(conf_fn, "w") as f:
-        f.write(json.dumps(experiment))
+        # a session keeps the server logs in its own directory until the
+        # run ends; summary.py --follow reads them there
+        if SESSION is not None:
+            f.write(json.dumps(dict(experiment, session_dir=SESSION['dir'])))
+        else:
+            f.write(json.dumps(experiment))
 
     # Record status of local git repo
     runcmd("(cd {}; git status; git diff) > {}/gitstatus.$(hostname -s).log".format(SDIR,
                                                                                     experiment['name']))
 
-    # Start mpstat
-    procs.append(subprocess.Popen("mpstat 1 -N 0,1 2>&1| ts %s > mpstat.{}.log".format(
-                                  THISHOST), shell=True, cwd=experiment['name']))
-
-    # Start cstate
-    procs.append(start_cstate())
-
-    # Run iokernel or dune
-    if experiment['system'] == "shenango":
-        procs.append(start_iokerneld(experiment))
-    elif experiment['system'] == "zygos":
-        switch_to_zygos()
-    else:
-        switch_to_linux()
+    # Start telemetry, cstate and the iokernel or NIC mode
+    procs += start_environment(experiment)
 
     if experiment['system'] == "arachne":
         procs.append(start_corearbiter(experiment))
@@ -923,44 +1587,212 @@ def assemble_pps_exper(thr):
     return x
 
 
-def verify_dates(host_list):
-    for i in range(3): # try a few extra times
-        while True:
-            dates = set(runremote("date +%s", host_list).splitlines())
-            if dates:
-                break
-            else:
-                print "retrying verify dates"
-        if len(dates) == 1:
-            return
+# Clock offsets are estimated NTP-style: over one ssh stream per host (on
+# the shared connection), the remote clock is read between two local ones
+# and the probe with the smallest round trip wins.
+CLOCK_PROBE = ("import sys, time\n"
+               "while sys.stdin.readline():\n"
+               "    sys.stdout.write(repr(time.time()) + chr(10))\n"
+               "    sys.stdout.flush()")
+
+def clock_offset(host, probes=16):
+    # -> (seconds host is ahead of us, round trip of the best probe)
+    started = time.time()
+    proc = subprocess.Popen(SSH.split() + [host, "python -u -c '{}'".format(CLOCK_PROBE)],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    best = None
+    try:
+        for i in range(probes):
+            t0 = time.time()
+            proc.stdin.write("\n")
+            proc.stdin.flush()
+            remote = float(proc.stdout.readline())
+            t1 = time.time()
+            if best is None or t1 - t0 < best[1]:
+                best = (remote - (t0 + t1) / 2, t1 - t0)
+    finally:
+        proc.stdin.close()
+        proc.wait()
+        record_remote_call(started, host, "ssh", time.time() - started)
+    return best
+
+def verify_clocks(experiment, hosts, when):
+    # Record each host's offset at the start or end of the run in
+    # clocks.json, with the drift between the two once both exist.
+    fn = "{}/clocks.json".format(experiment['name'])
+    try:
+        with open(fn) as f:
+            clocks = json.loads(f.read())
+    except IOError:
+        clocks = {}
+    results = {}
+    errors = {}
+    def probe(h):
+        try:
+            results[h] = clock_offset(h)
+        except Exception as e:
+            errors[h] = e
+    remote = [h for h in hosts if h != THISHOST]
+    threads = [tagged_thread(probe, h) for h in remote]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    missing = [h for h in remote if h not in results]
+    assert not missing, "could not measure the clock on {}: {}".format(
+        ", ".join(missing), "; ".join("{}: {}".format(h, errors.get(h)) for h in missing))
+    for host, (offset, rtt) in results.items():
         # Not more than one second off
-        if len(dates) == 2:
-            d1 = int(dates.pop())
-            d2 = int(dates.pop())
-            if (d1 - d2)**2 == 1:
-                return
-        time.sleep(1)
-    assert False
-
+        assert abs(offset) < 1, "clock on {} is {:.3f}s off".format(host, offset)
+        c = clocks.setdefault(host, {})
+        c[when] = {'time': time.time(), 'offset': offset, 'rtt': rtt}
+        if 'start' in c and 'end' in c:
+            c['drift'] = (c['end']['offset'] - c['start']['offset']) / (c['end']['time'] - c['start']['time'])
+        print "clock {}: {} offset {:+.6f}s rtt {:.6f}s".format(when, host, offset, rtt)
+    with open(fn, "w") as f:
+        f.write(json.dumps(clocks, indent=2, sort_keys=True))
+
+
+def observer_hosts(experiment):
+    observer = experiment.get('observer', OBSERVER)
+    return [observer] if observer else []
+
+# Client files live in a content-addressed cache on each remote host
+# (~/ARTIFACT_DIR/<sha256>), so a file is only sent to hosts that have
+# never seen that exact content and each run just hard-links it in place.
+ARTIFACT_DIR = ".shenango-artifacts"
+
+# local path -> ((mtime, size), sha256)
+ARTIFACT_HASHES = {}
+
+def artifact_hash(path):
+    st = os.stat(path)
+    key = (st.st_mtime, st.st_size)
+    if path not in ARTIFACT_HASHES or ARTIFACT_HASHES[path][0] != key:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), ""):
+                h.update(chunk)
+        ARTIFACT_HASHES[path] = (key, h.hexdigest())
+    return ARTIFACT_HASHES[path][1]
+
+def push_artifacts(files, dest, hosts):
+    hashes = [artifact_hash(f) for f in files]
+    cached = {}
+    out = runpara("{ssh} {{}} 'mkdir -p {cache} {dest} && ls {cache}' | sed 's/^/{{}} /'".format(
+        ssh=SSH, cache=ARTIFACT_DIR, dest=dest), hosts)
+    for line in out.splitlines():
+        host, _, name = line.partition(" ")
+        cached.setdefault(host, set()).add(name)
+    for f, h in sorted(set(zip(files, hashes))):
+        missing = [host for host in hosts if h not in cached.get(host, ())]
+        if not missing:
+            continue
+        runpara("{scp} -p {f} {{}}:{cache}/{h}.tmp && {ssh} {{}} mv {cache}/{h}.tmp {cache}/{h}".format(
+            scp=SCP, ssh=SSH, f=f, cache=ARTIFACT_DIR, h=h), missing)
+    links = " && ".join("ln -f {}/{} {}/{}".format(ARTIFACT_DIR, h, dest, os.path.basename(f))
+                        for f, h in zip(files, hashes))
+    runpara("{ssh} {{}} '{links}'".format(ssh=SSH, links=links), hosts)
 
 def setup_clients(experiment):
     servers = experiment['clients'].keys()
-    verify_dates(servers + [OBSERVER])
-    runremote("mkdir -p {}".format(
-        experiment['name']), servers + [OBSERVER])
+    verify_clocks(experiment, servers + observer_hosts(experiment), "start")
+    push_artifacts(experiment['client_files'], experiment['name'],
+                   servers + observer_hosts(experiment))
+    # the config is the only file that changes every run
     conf_fn = experiment['name'] + "/config.json"
-    for i in experiment['client_files'] + [conf_fn, RSTAT]:
-        runpara("scp {binary} {{}}:{dest}/".format(binary=i,
-                                                   dest=experiment['name']), servers + [OBSERVER])
-
-def collect_clients(experiment):
-    runpara("scp {{}}:{exp}/*.log {exp}/ || true".format(exp=experiment['name']), experiment['clients'].keys() + [OBSERVER])
-    runpara("scp {{}}:{exp}/*.out {exp}/ || true".format(exp=experiment['name']), experiment['clients'].keys())
-    runpara("scp {{}}:{exp}/*.err {exp}/ || true".format(exp=experiment['name']), experiment['clients'].keys())
-    runremote(
-        "rm -rf {}".format(experiment['name']), experiment['clients'].keys() + [OBSERVER])
+    runpara("{scp} {conf} {{}}:{dest}/".format(scp=SCP, conf=conf_fn, dest=experiment['name']),
+            servers + observer_hosts(experiment))
+
+# Each host's results come back as one gzipped tar stream with a sha256
+# manifest; the remote copy is only removed once the manifest checks out.
+COLLECT_GLOBS = "*.log *.out *.err *.jsonl"
+
+def collect_clients(experiment, hosts=None):
+    if hosts is None:
+        hosts = experiment['clients'].keys() + observer_hosts(experiment)
+    if not hosts:
+        return
+    # parallel runs one job per host, so hosts also decompress in parallel
+    runpara(("{ssh} {{}} 'cd {exp} && sha256sum {globs} > MANIFEST.{{}} 2>/dev/null; "
+             "tar cf - MANIFEST.{{}} {globs} 2>/dev/null | gzip -1' | tar xzf - -C {exp} && "
+             "(cd {exp} && sha256sum --quiet -c MANIFEST.{{}}) && {ssh} {{}} rm -rf {exp} || "
+             "echo collection from {{}} failed verification, leaving {exp} in place").format(
+                ssh=SSH, exp=experiment['name'], globs=COLLECT_GLOBS), hosts)
     return
 
+# While a run is in progress, the client outputs and the observer's
+# rstat.jsonl are mirrored into the server's run directory for
+# summary.py --follow. rsync --append only sends what each file gained
+# since the last pass, over the host's pooled connection.
+STREAM_INTERVAL = 2.0
+STREAM_GLOBS = ["*.out", "rstat.jsonl"]
+
+def stream_clients(experiment, collected, stop, lock):
+    # until stop is set, every stream_interval seconds (0 turns it off).
+    # Hosts in collected are skipped; a host is added there under lock, so
+    # no pass is still writing its files when its collection starts.
+    interval = experiment.get('stream_interval', STREAM_INTERVAL)
+    if not interval:
+        return
+    filters = " ".join("--include '{}'".format(g) for g in STREAM_GLOBS)
+    while not stop.wait(interval):
+        with lock:
+            hosts = [h for h in experiment['clients'].keys() + observer_hosts(experiment)
+                     if h not in collected and h != THISHOST]
+            if not hosts:
+                continue
+            runpara("{rsync} -r --append {filters} --exclude '*' {{}}:{exp}/ {exp}/ 2>/dev/null || true".format(
+                rsync=RSYNC, filters=filters, exp=experiment['name']), hosts)
+
+def run_clients(experiment, collected):
+    # Run every client host and collect each one's results as soon as it
+    # finishes, while the others are still running; until then their
+    # outputs are streamed in by stream_clients. Like
+    # runremote(die_on_failure=True), a failing host stops the rest.
+    cmd = "ulimit -S -c unlimited; python {dir}/{script} client {dir} > {dir}/py.{{host}}.log 2>&1".format(
+        dir=experiment['name'], script=os.path.basename(__file__))
+    procs = {}
+    started = {}
+    for host in experiment['clients']:
+        started[host] = time.time()
+        procs[host] = subprocess.Popen("exec {ssh} -t -t {host} '{cmd}'".format(
+            ssh=SSH, host=host, cmd=cmd.format(host=host)), shell=True)
+    collectors = []
+    failed = []
+    stop = threading.Event()
+    lock = threading.Lock()
+    streamer = tagged_thread(stream_clients, experiment, collected, stop, lock)
+    streamer.start()
+    try:
+        while procs:
+            for host, p in procs.items():
+                if p.poll() is None:
+                    continue
+                del procs[host]
+                record_remote_call(started[host], host, "ssh", time.time() - started[host])
+                if p.returncode != 0 and not failed:
+                    failed.append(host)
+                    for other in procs.values():
+                        other.terminate()
+                with lock:
+                    collected.append(host)
+                t = tagged_thread(collect_clients, experiment, [host])
+                t.start()
+                collectors.append(t)
+            time.sleep(0.2)
+    finally:
+        stop.set()
+        streamer.join()
+        for host, p in procs.items():
+            p.terminate()
+            p.wait()
+            record_remote_call(started[host], host, "ssh", time.time() - started[host])
+        for t in collectors:
+            t.join()
+    if failed:
+        raise Exception("client run failed on {}".format(failed[0]))
+
 def execute_experiment_noclients(experiment):
     assert len(experiment['clients']) == 0
     procs = go_server(experiment)
@@ -978,29 +1810,57 @@ def execute_experiment_noclients(experiment):
             pass
         p.wait()
         del p
-    exitfn()
+    exitfn(keep_env=SESSION is not None)
+    finish_environment(experiment)
 
 def execute_experiment(experiment):
+    # this thread's remote calls are now this experiment's
+    REMOTE_TAG.experiment = experiment['name']
     procs = go_server(experiment)
     setup_clients(experiment)
-    time.sleep(10)
+    # apps that could not be confirmed ready get SETTLE_SECS from their
+    # launch to settle, which the survival window (or probe timeout) they
+    # already waited out counts towards
+    unconfirmed = [start for _, confirmed, start in STARTUP_STAGES.get(experiment['name'], [])
+                   if not confirmed]
+    if unconfirmed:
+        time.sleep(max(0, max(unconfirmed) + SETTLE_SECS - time.time()))
     observer = None
+    collected = []
     try:
-        observer_cmd = "exec ssh -t -t {observer} 'python {dir}/{script} observer {dir} > {dir}/py.{observer}.log 2>&1'".format(
-            observer=OBSERVER, dir=experiment['name'], script=os.path.basename(__file__))
-        if OBSERVER: observer = subprocess.Popen(observer_cmd, shell=True)
-        runremote("ulimit -S -c unlimited; python {dir}/{script} client {dir} > {dir}/py.{{}}.log 2>&1".format(dir=experiment[
-                  'name'], script=os.path.basename(__file__)), experiment['clients'].keys(), die_on_failure=True)
+        for host in observer_hosts(experiment):
+            observer_cmd = "exec {ssh} -t -t {observer} 'python {dir}/{script} observer {dir} > {dir}/py.{observer}.log 2>&1'".format(
+                ssh=SSH, observer=host, dir=experiment['name'], script=os.path.basename(__file__))
+            observer = subprocess.Popen(observer_cmd, shell=True)
+            observer_started = time.time()
+        run_clients(experiment, collected)
+        verify_clocks(experiment, experiment['clients'].keys() + observer_hosts(experiment), "end")
     finally:
-        collect_clients(experiment)
+        # stop the observer before collecting from its host, as it keeps
+        # appending to rstat.jsonl and would fail the manifest check
         if observer:
             observer.terminate()
             observer.wait()
+            record_remote_call(observer_started, host, "ssh", time.time() - observer_started)
+            # the hangup reaches it asynchronously; make sure it has exited
+            script = os.path.basename(__file__)
+            pattern = "[{}]{}.observer.{}".format(script[0], script[1:], experiment['name'])
+            runpara("{ssh} {{}} 'pkill -f {p}; while pgrep -f {p} >/dev/null; do sleep 0.1; done'".format(
+                ssh=SSH, p=pattern), observer_hosts(experiment))
+        collect_clients(experiment, [h for h in experiment['clients'].keys() + observer_hosts(experiment)
+                                     if h not in collected])
     for p in procs:
         p.terminate()
         p.wait()
         del p
-    exitfn()
+    exitfn(keep_env=SESSION is not None)
+    finish_environment(experiment)
+    with open("{}/remote_calls.{}.log".format(experiment['name'], THISHOST), "w") as f:
+        for (host, kind), st in sorted(remote_call_stats(experiment['name']).items()):
+            line = "{} {} calls={calls} total={total:.3f}s mean={mean:.3f}s max={max:.3f}s".format(
+                host, kind, **st)
+            print "remote calls:", line
+            f.write(line + "\n")
     return experiment
 
 
@@ -1013,6 +1873,268 @@ def rep_external(fn, mpps, samples, *args, **kwargs):
         xp['name'] += '-{}mpps'.format(mpps_local)
         execute_experiment(xp)
 
+########################## CAMPAIGNS ###############################
+
+# Hosts are leased exclusively for the whole of an experiment, so a host's
+# NIC mode (switch_to_linux/shenango/zygos) is only ever changed by the one
+# experiment holding it.
+HOST_LEASES = {'busy': set(), 'cond': threading.Condition()}
+
+# Shenango IPs handed to each concurrently running experiment
+IP_BLOCK = 48
+
+def pick_hosts(wanted, busy):
+    # wanted: [(pool, count)...] -> count hosts of every pool that are not
+    # busy, all different; None if there are not enough
+    got = []
+    for pool, count in wanted:
+        free = [h for h in pool if h not in busy and h not in got]
+        if len(free) < count:
+            return None
+        got += free[:count]
+    return got
+
+def lease_hosts(wanted):
+    # Blocks until pick_hosts(wanted) finds hosts, then takes them all at
+    # once.
+    cond = HOST_LEASES['cond']
+    with cond:
+        while True:
+            got = pick_hosts(wanted, HOST_LEASES['busy'])
+            if got is not None:
+                HOST_LEASES['busy'].update(got)
+                return got
+            cond.wait()
+
+def release_hosts(hosts):
+    cond = HOST_LEASES['cond']
+    with cond:
+        HOST_LEASES['busy'].difference_update(hosts)
+        cond.notify_all()
+
+def retarget_experiment(experiment, server, clients, observer, ip_block=0):
+    # Copy of experiment moved onto a different server, client hosts and
+    # observer, with its shenango IPs shifted into block ip_block so that
+    # concurrent experiments do not collide on the shared network.
+    x = copy.deepcopy(experiment)
+    old_server = x['server_hostname']
+    hostmap = dict(zip(sorted(x['clients']), clients))
+
+    def move_ip(ip):
+        if ip == LNX_IPS.get(old_server):
+            return LNX_IPS[server]
+        node = int(ip.rsplit(".", 1)[1])
+        if ip.startswith(NETPFX + ".") and node >= 100:
+            return IP(100 + IP_BLOCK * ip_block + node - 100)
+        return ip
+
+    x['server_hostname'] = server
+    x['observer'] = observer
+    for app in x['apps']:
+        app['ip'] = move_ip(app['ip'])
+    old_clients = x['clients']
+    x['clients'] = {}
+    for old, new in hostmap.items():
+        x['clients'][new] = old_clients[old]
+        for cfg in x['clients'][new]:
+            cfg['ip'] = move_ip(cfg['ip'])
+            cfg['serverip'] = move_ip(cfg['serverip'])
+            cfg['host'] = new
+            cfg['name'] = cfg['name'].replace("-{}.".format(old), "-{}.".format(new), 1)
+            if cfg['leader'] in hostmap:
+                cfg['leader'] = hostmap[cfg['leader']]
+            else:
+                cfg['leader'] = OOB_IPS[hostmap[next(
+                    h for h in hostmap if OOB_IPS[h] == cfg['leader'])]]
+    return x
+
+def execute_remote(experiment):
+    # Run experiment on its (non-local) server host and copy the results
+    # back. The server runs this copy of experiment.py, not its own.
+    server = experiment['server_hostname']
+    rdir = "{}/{}".format(BASE_DIR, experiment['name'])
+    script = "{}/{}".format(experiment['name'], os.path.basename(__file__))
+    experiment['client_files'] = [script if f == __file__ else f for f in experiment['client_files']]
+    runcmd("mkdir -p {}".format(rdir))
+    with open(rdir + "/config.json", "w") as f:
+        f.write(json.dumps(experiment))
+    runpara("{} {{}} mkdir -p {}".format(SSH, rdir), [server])
+    runpara("{} {} {}/config.json {{}}:{}/".format(SCP, __file__, rdir, rdir), [server])
+    try:
+        runremote("cd {base}; python {script} execute {dir} > {dir}/py.{server}.log 2>&1".format(
+            server=server, base=BASE_DIR, script=script, dir=experiment['name']), [server])
+    finally:
+        runpara("{} -a {{}}:{}/ {}/ || true".format(RSYNC, rdir, rdir), [server])
+
+def run_campaign(experiments, servers=None, clients=None, observers=()):
+    # Run experiments from bench_memcached/bench_dns/assemble_synthetic etc.
+    # concurrently on disjoint leased hosts, starting them in order as
+    # hosts free up. Shenango experiments also lease an observer when
+    # observers are given; otherwise they run without rstat collection.
+    # A failed experiment does not stop the others; the failures are
+    # raised together once every experiment has finished.
+    servers = list(servers or SERVER_MACS.keys())
+    clients = list(clients or CLIENT_POOL)
+    assert is_server()
+    names = set()
+    threads = []
+    failures = []
+
+    def wanted_hosts(experiment):
+        wanted = [(servers, 1), (clients, len(experiment['clients']))]
+        if observers and experiment['system'] == "shenango":
+            wanted.append((observers, 1))
+        return wanted
+
+    # an experiment the pools cannot hold even when all are free would
+    # wait for its lease forever
+    for experiment in experiments:
+        assert pick_hosts(wanted_hosts(experiment), set()) is not None, \
+            "{} needs more hosts than {}".format(experiment['name'], wanted_hosts(experiment))
+
+    def run_leased(x, hosts):
+        try:
+            if x['server_hostname'] == THISHOST:
+                execute_experiment(x)
+            else:
+                execute_remote(x)
+        except Exception as e:
+            traceback.print_exc()
+            failures.append((x['name'], e))
+        finally:
+            release_hosts(hosts)
+
+    for experiment in experiments:
+        # experiments built in the same second share a name
+        while experiment['name'] in names:
+            experiment['name'] += "-1"
+        names.add(experiment['name'])
+
+        wanted = wanted_hosts(experiment)
+        hosts = lease_hosts(wanted)
+        server, nodes = hosts[0], hosts[1:1 + len(experiment['clients'])]
+        observer = hosts[-1] if len(wanted) == 3 else None
+        x = retarget_experiment(experiment, server, nodes, observer,
+                                ip_block=servers.index(server))
+        print "Starting", x['name'], "on", server, nodes, observer
+        t = threading.Thread(target=run_leased, args=(x, hosts))
+        t.start()
+        threads.append(t)
+
+    for t in threads:
+        t.join()
+    if failures:
+        raise Exception("{} of {} experiments failed: {}".format(
+            len(failures), len(threads), "; ".join("{}: {}".format(n, e) for n, e in failures)))
+
+def go_execute(exp_folder):
+    assert is_server()
+    with open("{}/config.json".format(exp_folder)) as f:
+        exp = json.loads(f.read())
+    execute_experiment(exp)
+
+def measure_load(fn, mpps, *args, **kwargs):
+    # One single-sample run at mpps; returns its first summary.py row.
+    import summary
+    xp = fn(*args, mpps=mpps, samples=1, **kwargs)
+    xp['name'] += '-{}mpps'.format(mpps)
+    execute_experiment(xp)
+    res = summary.do_it_all(xp['name'], verbose=False)
+    row = {k: v[0] for k, v in res.items()}
+    row['run'] = xp['name']
+    return row
+
+# find the knee of the latency curve instead of sweeping uniformly
+def capacity_search(fn, mpps, slo_us, *args, **kwargs):
+    # Bisect offered load in (min_mpps, mpps] for the highest load at which
+    # the pct latency stays within slo_us and at least min_achieved of the
+    # offered load is served. Each load is measured repeats times and the
+    # search follows the median. Stops once the bracket is narrower than
+    # tolerance (relative) or after max_rounds measured loads.
+    #
+    # The knee is estimated as the middle of the median bracket (None if no
+    # load passed), and bounded by the repeats: every repeat passed at
+    # every measured load up to knee_low_mpps, and failed at every one from
+    # knee_high_mpps up. Loads with mixed repeats lie between the two. A
+    # bound is None when no measured load qualifies: the lowest already had
+    # a failing repeat, or the highest a passing one (so the knee may lie
+    # beyond mpps). Returns the result, also recorded in capacity.json in
+    # the first measured run's directory.
+    pct = kwargs.pop('pct', 'p99')
+    repeats = kwargs.pop('repeats', 3)
+    tolerance = kwargs.pop('tolerance', 0.05)
+    max_rounds = kwargs.pop('max_rounds', 12)
+    min_achieved = kwargs.pop('min_achieved', 0.95)
+    lo = kwargs.pop('min_mpps', 0.0)
+    hi = mpps
+
+    points = []
+
+    def passes(load):
+        rows = [measure_load(fn, load, *args, **kwargs) for i in range(repeats)]
+        served = [float(r['achieved']) / r['offered'] for r in rows]
+        repeat_ok = [r[pct] <= slo_us and sv >= min_achieved for r, sv in zip(rows, served)]
+        lat = sorted(r[pct] for r in rows)[len(rows) // 2]
+        med_served = sorted(served)[len(rows) // 2]
+        ok = lat <= slo_us and med_served >= min_achieved
+        verdict = "pass-all" if all(repeat_ok) else "fail-all" if not any(repeat_ok) else "mixed"
+        points.append({'mpps': load, pct: lat, 'served': med_served, 'pass': ok,
+                       'repeat_' + pct: [r[pct] for r in rows], 'repeat_served': served,
+                       'repeat_pass': repeat_ok, 'verdict': verdict,
+                       'runs': [r['run'] for r in rows]})
+        print "capacity search: {} mpps -> {} {}us, {:.1%} served: {} ({} of {} repeats passed)".format(
+            load, pct, lat, med_served, "pass" if ok else "fail", sum(repeat_ok), len(rows))
+        return ok
+
+    passing, failing = None, None
+    if passes(hi):
+        passing = hi # the knee is beyond the range searched
+    else:
+        failing = hi
+        while len(points) < max_rounds and (hi - lo) > tolerance * hi:
+            mid = round((lo + hi) / 2, 4)
+            if passes(mid):
+                lo = passing = mid
+            else:
+                hi = failing = mid
+
+    if passing is None:
+        knee = None
+    elif failing is None:
+        knee = passing
+    else:
+        knee = (passing + failing) / 2
+    measured = sorted(points, key=lambda p: p['mpps'])
+    low = high = None
+    for p in measured:
+        if p['verdict'] != "pass-all":
+            break
+        low = p['mpps']
+    for p in reversed(measured):
+        if p['verdict'] != "fail-all":
+            break
+        high = p['mpps']
+    result = {
+        'slo_us': slo_us,
+        'pct': pct,
+        'repeats': repeats,
+        'knee_mpps': knee,
+        'knee_low_mpps': low,
+        'knee_high_mpps': high,
+        'highest_pass_mpps': passing,
+        'lowest_fail_mpps': failing,
+        'points': points,
+    }
+    with open("{}/capacity.json".format(points[0]['runs'][0]), "w") as f:
+        f.write(json.dumps(result, indent=1))
+    if knee is None:
+        print "capacity search: no capacity found, every load down to {} mpps failed".format(failing)
+    else:
+        print "capacity search: knee at {} mpps, above {} and below {}".format(
+            knee, "no load that passed every repeat" if low is None else "{} (every repeat passed)".format(low),
+            "no load that failed every repeat" if high is None else "{} (every repeat failed)".format(high))
+    return result
+
 def go_replay(exp_folder):
     assert is_server()
     try:
@@ -1027,35 +2149,67 @@ def go_replay(exp_folder):
     execute_experiment(exp)
 
 
+# Build variants: copies of SDIR with compile-time knobs patched in, built
+# once into VARIANT_DIR/<hash of source tree and patch>. The copies start
+# from SDIR's own build outputs, so each variant is an incremental build,
+# and SDIR itself is never modified.
+VARIANT_DIR = "{}/variants".format(BASE_DIR)
+
+def build_variant(patch, cargo=False):
+    # patch: shell commands run at the top of the copy. cargo also rebuilds
+    # the synthetic app against the patched runtime.
+    h = hashlib.sha256()
+    # untracked sources count too: by name, and by content
+    h.update(runcmd("git rev-parse HEAD && git diff && git status --porcelain && "
+                    "git ls-files -z -o --exclude-standard | xargs -0 -r sha256sum", cwd=SDIR))
+    h.update("\n".join(patch) + "\n" + str(cargo))
+    vdir = "{}/{}/".format(VARIANT_DIR, h.hexdigest()[:16])
+    if os.access(vdir + ".built", os.F_OK):
+        return vdir
+    runcmd("mkdir -p {}".format(vdir))
+    # dpdk is big and never patched, so every variant shares SDIR's
+    runcmd("rsync -a --delete --exclude /dpdk --exclude /.git {} {}".format(SDIR, vdir))
+    runcmd("ln -sfn {}dpdk {}dpdk".format(SDIR, vdir))
+    for cmd in patch:
+        runcmd(cmd, cwd=vdir)
+    runcmd("make", cwd=vdir)
+    if cargo:
+        # cargo does not track the C runtime it links, so the target/ copied
+        # from SDIR would keep binaries built against the unpatched one
+        runcmd("cargo clean && cargo build --release", cwd=vdir + "apps/synthetic/")
+    with open(vdir + ".built", "w") as f:
+        f.write("\n".join(patch) + "\n")
+    return vdir
+
+def use_variant(experiment, vdir):
+    # run the server's shenango binaries and the client binary from vdir
+    experiment['sdir'] = vdir
+    experiment['client_files'] = [variant_path(experiment, f) for f in experiment['client_files']]
+
+def variant_path(experiment, path):
+    if experiment.get('sdir') and THISHOST == experiment['server_hostname'] and path.startswith(SDIR):
+        return experiment['sdir'] + path[len(SDIR):]
+    return path
+
 def run_balancer_experiment(interval):
-    subprocess.check_call("git diff --exit-code iokernel/main.c > /dev/null", shell=True, cwd=SDIR)
-    try:
-        subprocess.check_call("sed 's/define CORES_ADJUST_INTERVAL_US.*/define CORES_ADJUST_INTERVAL_US {}/g' -i iokernel/main.c".format(interval), shell=True, cwd=SDIR)
-        subprocess.check_call("make", shell=True, cwd=SDIR)
-        x = assemble_synthetic("shenango", 14, dist="exponential", mpps=1.4, bg="swaptions", samples=20)
-        x['name'] += "-{}us_balancer".format(interval)
-        execute_experiment(x)
-    finally:
-        subprocess.check_call("git checkout iokernel/main.c", shell=True, cwd=SDIR)
-        subprocess.check_call("make", shell=True, cwd=SDIR)
+    vdir = build_variant(["sed 's/define CORES_ADJUST_INTERVAL_US.*/define CORES_ADJUST_INTERVAL_US {}/g' -i iokernel/main.c".format(interval)])
+    x = assemble_synthetic("shenango", 14, dist="exponential", mpps=1.4, bg="swaptions", samples=20)
+    x['name'] += "-{}us_balancer".format(interval)
+    use_variant(x, vdir)
+    execute_experiment(x)
 
 
 def run_cycle_counting_experiment():
-    subprocess.check_call("git diff --exit-code runtime/defs.h > /dev/null", shell=True, cwd=SDIR)
-    try:
-        subprocess.check_call("echo \"#define TCP_RX_STATS 1\" >> runtime/defs.h", shell=True, cwd=SDIR)
-        subprocess.check_call("make", shell=True, cwd=SDIR)
-        subprocess.check_call("cargo clean && cargo build --release", shell=True, cwd=SDIR + "/apps/synthetic/")
-        for nconns in [24, 1200]:
-            x = assemble_synthetic("shenango", 14, dist="exponential", mpps=1.4, bg="swaptions", samples=20, nconns=nconns)
-            x['name'] += "-{}conns-cycle_counted".format(nconns)
-            execute_experiment(x)
-    finally:
-        subprocess.check_call("git checkout runtime/defs.h", shell=True, cwd=SDIR)
-        subprocess.check_call("make", shell=True, cwd=SDIR)
-        subprocess.check_call("cargo clean && cargo build --release", shell=True, cwd=SDIR + "/apps/synthetic/")
+    vdir = build_variant(["echo \"#define TCP_RX_STATS 1\" >> runtime/defs.h"], cargo=True)
+    for nconns in [24, 1200]:
+        x = assemble_synthetic("shenango", 14, dist="exponential", mpps=1.4, bg="swaptions", samples=20, nconns=nconns)
+        x['name'] += "-{}conns-cycle_counted".format(nconns)
+        use_variant(x, vdir)
+        execute_experiment(x)
 
 def paper_experiments():
+    calibrate_host()
+
     # load shift experiment
     if False:
         execute_experiment(loadshift("shenango"))
@@ -1124,6 +2278,7 @@ def paper_experiments():
 
 if __name__ == '__main__':
     atexit.register(exitfn)
+    atexit.register(close_ssh_pool)
     if len(sys.argv) < 2 or sys.argv[1] == "server":
         assert is_server()
 
@@ -1138,5 +2293,14 @@ if __name__ == '__main__':
     elif sys.argv[1] == "replay":
         assert len(sys.argv) == 3
         go_replay(sys.argv[2])
+    elif sys.argv[1] == "execute":
+        assert len(sys.argv) == 3
+        go_execute(sys.argv[2])
+    elif sys.argv[1] == "calibrate":
+        assert is_server()
+        calibrate_host()
+    elif sys.argv[1] == "telemetry":
+        assert len(sys.argv) in [3, 4]
+        go_telemetry(sys.argv[2], *[float(a) for a in sys.argv[3:]])
     else:
         assert False, 'bad arg'
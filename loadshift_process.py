@@ -1,74 +1,112 @@
-import sys, os
+import sys, os, shutil, tempfile
 
+from collections import defaultdict, deque
 from heapq import merge
+from itertools import islice
 from multiprocessing import Pool
 
+import numpy as np
+
+from summary import load_trace
+
 WARMUP=1e9
 
-def readfile(f):
-		with open(f) as ff:
-			dat = ff.read().splitlines()
-		dat = filter(lambda d: d.startswith("Trace: "), dat)
-		dat = [t[len("Trace: "):].split() for t in dat]
-		dat = [map(float, x.split(":")) for t in dat for x in t]
-		x = sorted([(a,c) if c > 0 else (a, float("inf")) for a,b,c in dat if a > 1e8+WARMUP])
-		return x
+def readfile(args):
+	# Sort one client's points and spill them to disk as a (2, n) array of
+	# start time and latency, so the parent never holds a whole trace.
+	f, outdir = args
+	trace, _ = load_trace(f)
+	start, _, latency = trace
+	keep = start > 1e8+WARMUP
+	start = start[keep].astype(float)
+	latency = latency[keep].astype(float)
+	latency[latency <= 0] = float("inf")
+	order = np.lexsort((latency, start))
+	out = "{}/{}.sorted.npy".format(outdir, os.path.basename(f))
+	np.save(out, np.vstack((start[order], latency[order])))
+	return out
+
+def readsorted(path, block=1 << 16):
+	points = np.load(path, mmap_mode="r")
+	for i in xrange(0, points.shape[1], block):
+		chunk = points[:, i:i + block]
+		for point in zip(chunk[0].tolist(), chunk[1].tolist()):
+			yield point
 
 def readdir(dirname):
 	files = ["{}/{}".format(dirname, f) for f in os.listdir(dirname) if f.endswith(".out")]
 
-	p = Pool()
-	sublists = p.map(readfile, files)
-	p.close()
-	p.join()
+	# spill next to the results rather than in /tmp, which may be tmpfs
+	tmpdir = tempfile.mkdtemp(prefix=".loadshift.", dir=dirname)
+	try:
+		p = Pool()
+		sorted_files = p.map(readfile, [(f, tmpdir) for f in files])
+		p.close()
+		p.join()
 
-	return merge(*sublists)
+		for point in merge(*map(readsorted, sorted_files)):
+			yield point
+	finally:
+		shutil.rmtree(tmpdir)
 
 def lat(l):
         PCT = 0.999
         w = sorted(l)
         return w[int(len(w)*PCT)-1] // 1e3
 
-def time_downsample(pairs, ns_per_sample=10000000):
+def window_percentile(hist, count, pct):
+	# hist: {microseconds: count} for one window; the count - sum(hist)
+	# dropped requests sort last
+	idx = int(count * pct) - 1
+	if idx < 0: idx += count
+	seen = 0
+	for micros in sorted(hist):
+		seen += hist[micros]
+		if seen > idx:
+			return micros
+	return float("inf")
+
+def time_downsample(pairs, ns_per_sample=10000000, min_tail=1000):
 
 	print "Sampling latency at {:,} ns intervals".format(ns_per_sample)
 
-	timestamps, latencies = zip(*pairs)
+	# Single pass over the merged stream. Only min_tail + 1 points are held
+	# as lookahead so that, like before, the final windows covering the last
+	# min_tail points are left out.
+	pairs = iter(pairs)
+	pending = deque(islice(pairs, min_tail + 1))
+	if not pending:
+		return [], [], []
 
-	print "Datapoints:", len(timestamps)
 	x_out = []
 	y_out = []
 	z_out = []
 	PCT = 0.999
-	base = timestamps[0] + ns_per_sample
-	while len(latencies) > 1000:
-		print len(latencies)
-		# count number of points in this interval
+	npoints = 0
+	base = pending[0][0] + ns_per_sample
+	while len(pending) > min_tail:
+		# bucket this interval's latencies by microsecond
+		hist = defaultdict(int)
 		i = 0
-		l = []
-		while i < len(timestamps) and timestamps[i] <= base:
-			l.append(latencies[i])
+		while pending and pending[0][0] <= base:
+			_, latency = pending.popleft()
+			pending.extend(islice(pairs, 1))
+			if latency != float("inf"):
+				hist[latency // 1e3] += 1
 			i += 1
 
-		# extract the latencies for this window
-		w = sorted(l)
-
 		# append timestamp, latency, throughput
 		x_out.append((base - ns_per_sample / 2) / 1e3) # microseconds
-		y_out.append(w[int(i*PCT)-1] // 1e3) # microseconds
+		y_out.append(window_percentile(hist, i, PCT) if i else None) # microseconds
 		z_out.append(1e9 * i / ns_per_sample) # pps
 
-		timestamps = timestamps[i:]
-		latencies = latencies[i:]
+		npoints += i
 		base += ns_per_sample
 
+	print "Datapoints:", npoints
 
 	first_ts = x_out[0]
 	x_out = map(lambda a: a - first_ts, x_out)
-	# p = Pool()
-	# y_out = p.map(lat, y_out_temp)
-	# p.close()
-	# p.join()
 	return x_out, y_out, z_out
 
 
@@ -77,7 +115,7 @@ def write_dat(dirn, xs, ys, zs):
 	with open(dirn + "/microburst.dat", "w") as f:
 		f.write("time_us p999 tput system\n")
 		for x, y, z in zip(xs, ys, zs):
-			f.write("{} {} {} {}\n".format(x, y, z, system))
+			f.write("{} {} {} {}\n".format(x, "NA" if y is None else y, z, system))
 
 
 write_dat(sys.argv[1], *time_downsample(readdir(sys.argv[1])))
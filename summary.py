@@ -1,79 +1,162 @@
 
-# usage: python summary.py <experiment directory>
+# usage: python summary.py [-j jobs] [--force] <experiment directory>...
+#        python summary.py --follow <experiment directory>
 
+import argparse
 import json
 import os
 import sys
+import sqlite3
+import struct
+import time
 from collections import defaultdict
-import re
+from multiprocessing import Pool
+
+import numpy as np
 
 DISPLAYED_RSTAT_FIELDS = ["parks", "p_rx_ooo", "p_reorder_time"]
 
+def lat_hist(micros, counts=None):
+    # Latency histogram: (2, k) int64 array of sorted distinct microsecond
+    # buckets and their counts. Duplicate buckets are summed.
+    micros, inverse = np.unique(np.asarray(micros, dtype=np.int64),
+                                return_inverse=True)
+    if counts is None:
+        counts = np.bincount(inverse, minlength=len(micros))
+    else:
+        counts = np.bincount(inverse, weights=counts, minlength=len(micros))
+    return np.vstack((micros, counts.astype(np.int64)))
+
+def percentiles(latd, targets):
+    # latd: (latency histogram, number_dropped)
+    # targets: percentile targets, ie [0.5, 0.99]
+    # Dropped requests count towards the total but sort after every bucket.
+    hist, dropped = latd
+    cum = np.cumsum(hist[1])
+    count = (cum[-1] if len(cum) else 0) + dropped
+    res = []
+    for target in targets:
+        target_idx = int(float(count) * target)
+        idx = np.searchsorted(cum, target_idx)
+        res.append(int(hist[0][idx]) if idx < len(cum) else float("inf"))
+    return res
+
 def percentile(latd, target):
-    # latd: ({microseconds: count}, number_dropped)
-    # target: percentile target, ie 0.99
-    latd, dropped = latd
-    count = sum([latd[k] for k in latd]) + dropped
-    target_idx = int(float(count) * target)
-    curIdx = 0
-    for k in sorted(latd.keys()):
-        curIdx += latd[k]
-        if curIdx >= target_idx:
-            return k
-    return float("inf")
+    return percentiles(latd, [target])[0]
 
 def read_lat_line(line):
     #line = line.split(" ", 1)[1]
     if line.startswith("Latencies: "):
         line = line[len("Latencies: "):]
-    d = {}
-    for l in line.strip().split():
-        micros, count = l.split(":")
-        d[int(micros)] = int(count)
-    return d
+    pairs = np.fromstring(line.replace(":", " "), dtype=np.int64, sep=" ")
+    return lat_hist(pairs[0::2], pairs[1::2])
 
-def read_trace_line(line):
+def parse_trace_line(line):
+    # "Trace: start:delay:latency ..." -> flat int64 array
     if line.startswith("Trace: "):
         line = line[len("Trace: "):]
-    points = []
-    lats = defaultdict(int)
-    for l in line.strip().split():
-        start, delay, latency = l.split(":")
-        if latency != "-1":
-            lats[int(latency) // 1000] += 1
-        if delay != "-1":
-            points.append((int(start), int(latency)))
+    flat = np.fromstring(line.replace(":", " "), dtype=np.int64, sep=" ")
+    assert len(flat) % 3 == 0, "truncated trace line"
+    return flat
+
+
+def build_trace_cache(filename):
+    # Parse every Trace line once. The points go to <file>.trace.npy as a
+    # (3, n) int64 array of start, delay and latency rows; the remaining
+    # lines go to <file>.trace.lines with each Trace line replaced by the
+    # [begin, end) column range it occupies in the array.
+    lines = []
+    chunks = []
+    npoints = 0
+    with open(filename) as f:
+        for line in f:
+            if not line.startswith("Trace: "):
+                lines.append(line)
+                continue
+            flat = parse_trace_line(line)
+            chunks.append(flat)
+            lines.append("Trace: {} {}\n".format(npoints, npoints + len(flat) // 3))
+            npoints += len(flat) // 3
+
+    trace = np.empty((3, npoints), dtype=np.int64)
+    pos = 0
+    for flat in chunks:
+        n = len(flat) // 3
+        trace[:, pos:pos + n] = flat.reshape(-1, 3).T
+        pos += n
+
+    if not npoints:
+        return trace, lines
+
+    try:
+        with open(filename + ".trace.npy.tmp", "wb") as f:
+            np.save(f, trace)
+        with open(filename + ".trace.lines.tmp", "w") as f:
+            f.writelines(lines)
+        os.rename(filename + ".trace.npy.tmp", filename + ".trace.npy")
+        os.rename(filename + ".trace.lines.tmp", filename + ".trace.lines")
+    except (IOError, OSError):
+        pass # read-only results directory, just don't cache
+    return trace, lines
+
+
+def load_trace(filename):
+    # Returns ((3, n) int64 array of start/delay/latency, lines), memory
+    # mapping the sidecar cache when it is newer than the raw output.
+    try:
+        mtime = os.stat(filename).st_mtime
+        if all(os.stat(filename + ext).st_mtime >= mtime
+               for ext in [".trace.npy", ".trace.lines"]):
+            trace = np.load(filename + ".trace.npy", mmap_mode="r")
+            with open(filename + ".trace.lines") as f:
+                return trace, f.readlines()
+    except (IOError, OSError, ValueError):
+        pass
+    return build_trace_cache(filename)
+
+
+def read_trace_line(trace, line):
+    # line: "Trace: begin end" from load_trace, indexing columns of trace
+    begin, end = map(int, line[len("Trace: "):].split())
+    return trace_sample(*trace[:, begin:end])
+
+
+def trace_sample(start, delay, latency):
+    lats = lat_hist(latency[latency != -1] // 1000)
+    sent = delay != -1
+    points = np.vstack((start[sent], latency[sent]))
     return lats, points
 
 
-# list_of_tuples: [({microseconds: count}, number_dropped)...]
+# list_of_tuples: [(latency histogram, number_dropped)...]
 def merge_lat(list_of_tuples):
-    dropped = 0
-    c = defaultdict(int)
-    for s in list_of_tuples:
-        for k in s[0]:
-            c[k] += s[0][k]
-        dropped += s[1]
-    return c, dropped
+    hists = [s[0] for s in list_of_tuples]
+    dropped = sum(s[1] for s in list_of_tuples)
+    return lat_hist(np.hstack([h[0] for h in hists]),
+                    np.hstack([h[1] for h in hists])), dropped
 
 
-def parse_loadgen_output(filename):
-    with open(filename) as f:
-        dat = f.read()
+LOADGEN_LINE_STARTS = ["Latencies: ", "Trace: ", "zero, ","exponential, ",
+                       "bimodal1, ", "constant, "]
 
-    samples = []
+def new_loadgen_state():
+    return {'offset': 0, 'header_line': None, 'samples': []}
 
-    line_starts = ["Latencies: ", "Trace: ", "zero, ","exponential, ",
-                   "bimodal1, ", "constant, "]
+def parse_loadgen_lines(state, lines, trace=None):
+    # Appends to state['samples']. Trace lines are "Trace: begin end"
+    # column ranges into trace when it is given (see load_trace), and the
+    # raw client output otherwise.
 
     def get_line_start(line):
-        for l in line_starts:
+        for l in LOADGEN_LINE_STARTS:
             if line.startswith(l): return l
         return None
 
+    samples = state['samples']
+
     """Distribution, Target, Actual, Dropped, Never Sent, Median, 90th, 99th, 99.9th, 99.99th, Start"""
-    header_line = None
-    for line in dat.splitlines():
+    header_line = state['header_line']
+    for line in lines:
 	#line = line.split(" ", 1)[1]
         line_start = get_line_start(line)
         if not line_start: continue
@@ -87,7 +170,10 @@ def parse_loadgen_output(filename):
                 'time': int(header_line[10]),
             })
         elif line_start == "Trace: ":
-            lats, tracepoints = read_trace_line(line)
+            if trace is None:
+                lats, tracepoints = trace_sample(*parse_trace_line(line).reshape(-1, 3).T)
+            else:
+                lats, tracepoints = read_trace_line(trace, line)
             samples.append({
                 'distribution': header_line[0],
                 'offered': int(header_line[1]),
@@ -106,33 +192,95 @@ def parse_loadgen_output(filename):
                  'offered': int(header_line[1]),
                  'achieved': 0,
                  'missed': int(header_line[4]),
-                 'latencies': ({}, int(header_line[3])),
+                 'latencies': (lat_hist([]), int(header_line[3])),
                  'time': int(header_line[5]),
             })
-    return samples
+    state['header_line'] = header_line
+    return state
 
+def parse_loadgen_output(filename):
+    trace, dat = load_trace(filename)
+    return parse_loadgen_lines(new_loadgen_state(), dat, trace)['samples']
+
+
+# Clients of one app start each sample together, so their measured start
+# times agree to within this many seconds.
+SAMPLE_TIME_TOLERANCE = 2
+
+def align_by_time(sets, tolerance=SAMPLE_TIME_TOLERANCE):
+    # sets: lists of samples, one per client (or app). Returns rows sorted
+    # by start time, each holding at most one sample of every set, or None
+    # where that set has no sample starting within tolerance of the row's.
+    entries = sorted((sample['time'], i, j) for i, samples in enumerate(sets)
+                     for j, sample in enumerate(samples))
+    rows = []
+    for t, i, j in entries:
+        # rows[k:] started within tolerance of t; the earliest of them
+        # without a sample of set i takes this one
+        k = len(rows)
+        while k and t - rows[k - 1][0] < tolerance:
+            k -= 1
+        for anchor, row in rows[k:]:
+            if row[i] is None:
+                row[i] = sets[i][j]
+                break
+        else:
+            row = [None] * len(sets)
+            row[i] = sets[i][j]
+            rows.append((t, row))
+    return [row for _, row in rows]
+
+def merge_samples(parts):
+    # one sample out of the same-time samples of several clients; 'clients'
+    # counts the client samples merged into it
+    assert len(set(p['distribution'] for p in parts)) == 1
+    newexp = {
+        'distribution': parts[0]['distribution'],
+        'offered': sum(p['offered'] for p in parts),
+        'achieved': sum(p['achieved'] for p in parts),
+        'missed': sum(p['missed'] for p in parts),
+        'latencies': merge_lat([p['latencies'] for p in parts]),
+        'time': min(p['time'] for p in parts),
+        'clients': sum(p.get('clients', 1) for p in parts),
+    }
+    traces = [p['tracepoints'] for p in parts if 'tracepoints' in p]
+    if traces:
+        newexp['tracepoints'] = np.hstack(traces)
+    return newexp
 
 def merge_sample_sets(a, b):
-    samples = []
-    for ea, eb in zip(a, b):
-        assert set(ea.keys()) == set(eb.keys())
-        assert ea['distribution'] == eb['distribution']
-        # assert ea['app'] == eb['app']
-        assert abs(ea['time'] - eb['time']) < 2
-        newexp = {
-            'distribution': ea['distribution'],
-            'offered': ea['offered'] + eb['offered'],
-            'achieved': ea['achieved'] + eb['achieved'],
-            'missed': ea['missed'] + eb['missed'],
-            'latencies': merge_lat([ea['latencies'], eb['latencies']]),
-            # 'app': ea['app'],
-            'time': min(ea['time'], eb['time']),
-        }
-        if 'tracepoints' in ea:
-            newexp['tracepoints'] = ea['tracepoints'] + eb['tracepoints']
-        samples.append(newexp)
-        assert set(ea.keys()) == set(newexp.keys())
-    return samples
+    # Samples are matched on start time, not position. A sample only one
+    # side reported is kept as it is, with fewer 'clients' behind it.
+    return [merge_samples([p for p in row if p is not None])
+            for row in align_by_time([a, b])]
+
+def sample_coverage(experiment):
+    # {client name: (samples reported, samples expected)}, expecting each
+    # client to report a sample at every start time of its app
+    coverage = {}
+    for app in experiment['apps']:
+        insts = app.get('loadgen_clients', [])
+        for inst in insts:
+            expected = max(len(app['loadgen']), inst.get('samples', 0))
+            coverage[inst['name']] = (len(inst['columns']['time']), expected)
+    return coverage
+
+def read_new_lines(fname, state, chunk_size=1 << 20):
+    # Yield batches of the complete lines appended to fname since
+    # state['offset'], advancing it as they are handed out. A trailing
+    # partial line is left for the next call.
+    with open(fname) as f:
+        f.seek(state['offset'])
+        tail = ""
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            chunk = tail + chunk
+            end = chunk.rfind("\n") + 1
+            state['offset'] += end
+            tail = chunk[end:]
+            yield chunk[:end].splitlines()
 
 def except_none(func):
 	def e(*args, **kwargs):
@@ -185,133 +333,472 @@ def load_app_output(app, directory, first_sample_time):
         'recorded_samples': datapoints
     }
 
+def new_utilization_state():
+    return {'offset': 0, 'lineno': 0, 'cols': None, 'nodes': defaultdict(list)}
+
+def follow_utilization(fname, state=None):
+    # Tail an "mpstat -N | ts" log, collecting (timestamp, 100 - %idle)
+    # points for each NUMA node.
+    if state is None:
+        state = new_utilization_state()
+    for lines in read_new_lines(fname, state):
+        for line in lines:
+            state['lineno'] += 1
+            l = line.split()
+            if "%iowait" in l and state['cols'] is None:
+                # assume max 2 nodes
+                assert "CPU" in l or "NODE" in l
+                state['cols'] = {h: pos for pos, h in enumerate(l)}
+            # the banner, header and first report are skipped
+            if state['lineno'] <= 4 or "%iowait" in l or len(l) <= 1:
+                continue
+            node = int(l[state['cols']['NODE']])
+            state['nodes'][node].append((int(l[0]), 100. - float(l[-1])))
+    return state
+
+# binary ring written by experiment.py's telemetry collector (go_telemetry)
+TELEMETRY_MAGIC = "SHTLM001"
+TELEMETRY_HEADER = struct.Struct("<8sIIIqqQ")
+
+def read_telemetry(fname, since=None):
+    # -> {'ts': wall-clock seconds, 'cpus', 'nodes', 'ctxt', 'softirq',
+    # 'jiffies': (n, ncpus, 2) busy/idle}, oldest record first. With since
+    # (wall-clock seconds), only the records from the last one before it.
+    with open(fname, "rb") as f:
+        head = f.read(TELEMETRY_HEADER.size)
+        magic, ncpus, capacity, _, anchor_mono, anchor_wall, count = TELEMETRY_HEADER.unpack(head)
+        assert magic == TELEMETRY_MAGIC, fname
+        table = np.fromstring(f.read(4 * ncpus), dtype="<u2")
+    data_start = (TELEMETRY_HEADER.size + 4 * ncpus + 7) // 8 * 8
+    dtype = np.dtype([('mono', '<i8'), ('ctxt', '<u8'), ('softirq', '<u8'),
+                      ('jiffies', '<u4', (ncpus, 2))])
+    if not capacity:
+        recs = np.zeros(0, dtype=dtype)
+    else:
+        recs = np.memmap(fname, dtype=dtype, mode="r", offset=data_start, shape=(capacity,))
+    n = min(count, capacity)
+    idx = np.arange(count - n, count) % capacity
+    if since is not None and n:
+        mono = recs['mono'][idx]
+        first = np.searchsorted(mono, anchor_mono + int((since - anchor_wall / 1e9) * 1e9))
+        idx = idx[max(first - 1, 0):]
+    recs = recs[idx]
+    return {
+        'ts': anchor_wall / 1e9 + (recs['mono'] - anchor_mono) / 1e9,
+        'cpus': table[0::2],
+        'nodes': table[1::2],
+        'ctxt': recs['ctxt'],
+        'softirq': recs['softirq'],
+        'jiffies': recs['jiffies'],
+    }
+
+def telemetry_utilization(tel):
+    # {node: (n, 2) array of (timestamp, 100 - %idle)} over each interval,
+    # stamped at its end like mpstat's
+    deltas = np.diff(tel['jiffies'].astype(np.int64), axis=0) % (1 << 32)
+    util = {}
+    for node in np.unique(tel['nodes']).tolist():
+        sel = tel['nodes'] == node
+        busy = deltas[:, sel, 0].sum(axis=1)
+        total = busy + deltas[:, sel, 1].sum(axis=1)
+        ok = total > 0
+        util[node] = np.column_stack((tel['ts'][1:][ok], 100. * busy[ok] / total[ok]))
+    return util
+
+def telemetry_rates(tel):
+    # {'ctxt': ..., 'softirq': ...}: (n, 2) arrays of (timestamp, events
+    # per second) over each interval, stamped at its end. Both counters
+    # are machine-wide.
+    dt = np.diff(tel['ts'])
+    ok = dt > 0
+    rates = {}
+    for k in ['ctxt', 'softirq']:
+        d = np.diff(tel[k].astype(np.int64))
+        rates[k] = np.column_stack((tel['ts'][1:][ok], d[ok] / dt[ok]))
+    return rates
+
 @except_none
-def parse_iokernel_log(dirn, experiment):
-    fname = "{dirn}/iokernel.{server_hostname}.log".format(
-        dirn=dirn, **experiment)
-    with open(fname) as f:
-        data = f.read()
-        int(data.split()[0])
-
-    stats = defaultdict(list)
-    data = data.split(" Stats:")[1:]
-    for d in data:
-        RX_P = None
-        for line in d.strip().splitlines():
-            if "eth stats for port" in line: continue
-            dats = line.split()
-            tm = int(dats[0])
-            for stat_name, stat_val in zip(dats[1::2], dats[2::2]):
-                stats[stat_name.replace(":", "")].append((tm, int(stat_val)))
-                if stat_name == "RX_PULLED:": RX_P = float(stat_val)
-                if stat_name == "BATCH_TOTAL:": stats['IOK_SATURATION'].append((tm, RX_P / float(stat_val)))
-    return stats
+def parse_counters(dirn, experiment):
+    # context switch and softirq rates from the telemetry ring; None for
+    # runs from before it, whose mpstat logs have neither
+    tel = "{dirn}/telemetry.{server_hostname}.bin".format(dirn=dirn, **experiment)
+    if not os.access(tel, os.F_OK):
+        return None
+    return telemetry_rates(read_telemetry(tel))
 
 @except_none
 def parse_utilization(dirn, experiment):
+    tel = "{dirn}/telemetry.{server_hostname}.bin".format(dirn=dirn, **experiment)
+    if os.access(tel, os.F_OK):
+        return telemetry_utilization(read_telemetry(tel))
+
     fname = "{dirn}/mpstat.{server_hostname}.log".format(
         dirn=dirn, **experiment)
     try:
         with open(fname) as f:
-            data = f.read().splitlines()
-        int(data[0].split()[0])
+            int(f.readline().split()[0])
     except:
         return None
 
-    cpuln = next(l for l in data if "_x86_64_" in l)
-    ncpu = int(re.match(".*\((\d+) CPU.*", cpuln).group(1))
-    headerln = next(l for l in data if "iowait" in l).split()
-    # assume max 2 nodes
-    assert "CPU" in headerln or "NODE" in headerln
-
-    cols = {h: pos for pos, h in enumerate(headerln)}
-
-    data = map(lambda l: l.split(), data)
-    data = filter(lambda l: "%iowait" not in l and len(l) > 1, data[4:])
-
-    if "NODE" in headerln:
-        data = filter(lambda l: int(l[cols['NODE']]) == 0, data)
-    else:
-        assert all(lambda l: l[cols['CPU']] == 'all', data)
-
-# % usr
-
-# 100.0 - %idle
-    data = map(lambda l: (int(l[0]), 100. - float(l[-1])), data)
-
-    if not "NODE" in headerln:
-        data = map(lambda a, b: a, 2 * b, data)
+    # only per-node output (mpstat -N) is understood
+    return dict(follow_utilization(fname)['nodes'])
+
+def experiment_nodes(experiment, default_node=0):
+    # NUMA nodes the server apps run on, as placed by experiment.py (which
+    # also uses this); apps without a placement run on the NIC's node
+    nodes = set(n for app in experiment['apps'] for n in app.get('numa_nodes', []))
+    return sorted(nodes) or [experiment.get('nic_node', default_node)]
+
+def utilization_windows(mpstat, experiment, nodes, starts, duration):
+    # Mean utilization of nodes over each window, weighted by the number of
+    # cpus in each node; None where some node has no points.
+    weights = experiment.get('node_cpus', {})
+    per_node = [(weights.get(str(n), 1), window_means(mpstat[n], starts, duration)
+                 if n in mpstat else [None] * len(starts)) for n in nodes]
+    if len(per_node) == 1:
+        return per_node[0][1]
+    out = []
+    for i in range(len(starts)):
+        if any(means[i] is None for _, means in per_node):
+            out.append(None)
+        else:
+            out.append(sum(w * means[i] for w, means in per_node) /
+                       float(sum(w for w, _ in per_node)))
+    return out
+
+def efficiency(achieved, cpu, experiment, nodes):
+    # requests per second for each busy cpu of nodes
+    weights = experiment.get('node_cpus', {})
+    if not cpu or any(str(n) not in weights for n in nodes):
+        return None
+    return achieved / (cpu / 100. * sum(weights[str(n)] for n in nodes))
+
+# rstat line layouts, keyed on the tag after the timestamp: the number of
+# whitespace-separated tokens and the field held at each numeric token.
+# Punctuation around the numbers ("(1.5%") is stripped before conversion.
+RSTAT_LINES = {
+    'net:': (25, [(3, 'rxpkt'), (5, 'rxbytes'), (9, 'txpkt'), (11, 'txbytes'),
+                  (14, 'drops'), (17, 'p_rx_ooo'), (22, 'p_reorder_time')]),
+    'sched:': (23, [(2, 'rescheds'), (4, 'schedtimepct'), (7, 'localschedpct'),
+                    (9, 'softirqs'), (11, 'stolenirqpct'), (13, 'cpupct'),
+                    (15, 'parks'), (17, 'migratedpct'), (19, 'preempts'),
+                    (21, 'stolenpct')]),
+}
+
+def append_point(state, field, ts, val):
+    # state['cols'][field] is a preallocated (capacity, 2) array holding
+    # state['n'][field] (timestamp, value) rows; capacity doubles when full
+    col = state['cols'][field]
+    n = state['n'][field]
+    if n == len(col):
+        col = np.resize(col, (2 * len(col), 2))
+        state['cols'][field] = col
+    col[n] = ts, val
+    state['n'][field] = n + 1
+
+def new_rstat_state(capacity=4096):
+    fields = [f for _, layout in RSTAT_LINES.values() for _, f in layout]
+    return {
+        'offset': 0,
+        'malformed': 0,
+        'n': {f: 0 for f in fields},
+        'cols': {f: np.empty((capacity, 2)) for f in fields},
+    }
 
-    return data
+def parse_rstat_lines(state, lines):
+    for line in lines:
+        toks = line.split()
+        if len(toks) < 2 or toks[1] not in RSTAT_LINES:
+            state['malformed'] += 1
+            continue
+        ntoks, layout = RSTAT_LINES[toks[1]]
+        if len(toks) != ntoks:
+            state['malformed'] += 1
+            continue
+        try:
+            ts = int(toks[0])
+            vals = [(f, float(toks[i].strip("(%,)"))) for i, f in layout]
+        except ValueError:
+            state['malformed'] += 1
+            continue
+        for field, val in vals:
+            append_point(state, field, ts, val)
+
+def follow_rstat(fname, state=None):
+    # Parse whatever complete lines were appended to fname since the byte
+    # offset saved in state.
+    if state is None:
+        state = new_rstat_state()
+    for lines in read_new_lines(fname, state):
+        parse_rstat_lines(state, lines)
+    return state
+
+def point_columns(state):
+    # {field: (n, 2) array of (timestamp, value)}
+    return {f: state['cols'][f][:state['n'][f]] for f in state['cols']}
+
+def percent(a, b):
+    return 100. * a / b if b else float("nan")
+
+# rstat fields from the deltas d of a runtime's counters over dt seconds,
+# computed as rstat.go does; cur holds the latest (non-delta) values
+RSTAT_COUNTERS = {
+    'rxpkt': lambda d, dt, cur: d['rx_packets'] / dt,
+    'rxbytes': lambda d, dt, cur: d['rx_bytes'] / dt,
+    'txpkt': lambda d, dt, cur: d['tx_packets'] / dt,
+    'txbytes': lambda d, dt, cur: d['tx_bytes'] / dt,
+    'drops': lambda d, dt, cur: d['drops'] / dt,
+    'p_rx_ooo': lambda d, dt, cur: percent(d['rx_tcp_out_of_order'],
+                                           d['rx_tcp_in_order'] + d['rx_tcp_out_of_order']),
+    'p_reorder_time': lambda d, dt, cur: percent(d['rx_tcp_text_cycles'],
+                                                 d['sched_cycles'] + d['program_cycles']),
+    'rescheds': lambda d, dt, cur: d['reschedules'] / dt,
+    'schedtimepct': lambda d, dt, cur: percent(d['sched_cycles'],
+                                               d['sched_cycles'] + d['program_cycles']),
+    'localschedpct': lambda d, dt, cur: percent(d['reschedules'] - d['threads_stolen'],
+                                                d['reschedules']),
+    'softirqs': lambda d, dt, cur: (d['softirqs_local'] + d['softirqs_stolen']) / dt,
+    'stolenirqpct': lambda d, dt, cur: percent(d['softirqs_stolen'],
+                                               d['softirqs_local'] + d['softirqs_stolen']),
+    'cpupct': lambda d, dt, cur: percent(d['sched_cycles'] + d['program_cycles'],
+                                         cur.get('cycles_per_us', 0) * 1e6 * dt),
+    'parks': lambda d, dt, cur: d['parks'] / dt,
+    'migratedpct': lambda d, dt, cur: percent(d['core_migrations'], d['parks']),
+    'preempts': lambda d, dt, cur: d['preemptions'] / dt,
+    'stolenpct': lambda d, dt, cur: percent(d['preemptions_stolen'], d['preemptions']),
+}
+
+def new_observer_state():
+    return {'offset': 0, 'malformed': 0, 'prev': {},
+            'names': defaultdict(new_rstat_state)}
+
+def follow_observer(fname, state=None):
+    # Tail the observer's rstat.jsonl (see experiment.py's go_observer).
+    # Each runtime's fields come from the deltas between its consecutive
+    # replies and are stamped with the later poll's time; a counter going
+    # backwards means the runtime restarted and starts a new baseline.
+    if state is None:
+        state = new_observer_state()
+    for lines in read_new_lines(fname, state):
+        for line in lines:
+            try:
+                record = json.loads(line)
+                t, stats = float(record['time']), record['stats']
+            except (ValueError, KeyError, TypeError):
+                state['malformed'] += 1
+                continue
+            for name, cur in stats.items():
+                prev = state['prev'].get(name)
+                state['prev'][name] = (t, cur)
+                if prev is None or t <= prev[0]:
+                    continue
+                d = defaultdict(int, {k: v - prev[1].get(k, 0) for k, v in cur.items()})
+                if any(v < 0 for v in d.values()):
+                    continue
+                for field, fn in RSTAT_COUNTERS.items():
+                    append_point(state['names'][name], field, t, float(fn(d, t - prev[0], cur)))
+    return state
+
+def parse_observer(directory):
+    # {runtime name: rstat point columns} from rstat.jsonl, or None for
+    # runs whose observer logged rstat.<name>.log files instead
+    fname = "{}/rstat.jsonl".format(directory)
+    try:
+        state = follow_observer(fname)
+    except IOError:
+        return None
+    if state['malformed']:
+        print >>sys.stderr, "{}: skipped {} malformed lines".format(
+            fname, state['malformed'])
+    return {name: point_columns(st) for name, st in state['names'].items()}
 
 def parse_rstat(app, directory):
     fname = "{}/rstat.{}.log".format(directory, app['name'])
     try:
-        with open(fname) as f:
-            data = f.read().splitlines()
-        int(data[0].split()[0])
-    except:
+        state = follow_rstat(fname)
+    except IOError:
         return None
-
-    stat_vec = defaultdict(list)
-
-    float_match = "([+-]*\d+.\d+|NaN|[+-]Inf)"
-    netln_match = "(\d+) net: RX {f} pkts, {f} bytes \| TX {f} pkts, {f} bytes \| {f} drops \| {f}% rx out of order \({f}% reorder time\)".format(f=float_match)
-    schedln_match = "(\d+) sched: {f} rescheds \({f}% sched time, {f}% local\), {f} softirqs \({f}% stolen\), {f} %CPU, {f} parks \({f}% migrated\), {f} preempts \({f} stolen\)".format(f=float_match)
-
-    for line in data:
-        match = re.match(netln_match, line)
-        if match:
-            ts = int(match.group(1))
-            stat_vec['rxpkt'].append((ts, float(match.group(2))))
-            stat_vec['rxbytes'].append((ts, float(match.group(3))))
-            stat_vec['txpkt'].append((ts, float(match.group(4))))
-            stat_vec['txbytes'].append((ts, float(match.group(5))))
-            stat_vec['drops'].append((ts, float(match.group(6))))
-            stat_vec['p_rx_ooo'].append((ts, float(match.group(7))))
-            stat_vec['p_reorder_time'].append((ts, float(match.group(8))))
+    if not any(state['n'].values()):
+        return None
+    if state['malformed']:
+        print >>sys.stderr, "{}: skipped {} unrecognized lines".format(
+            fname, state['malformed'])
+    return point_columns(state)
+
+def new_iokernel_state():
+    # columns are added as stats first appear, in the same layout as rstat's
+    return {'offset': 0, 'malformed': 0, 'in_record': False, 'rx_pulled': None,
+            'last_tm': None, 'interval': None, 'n': {}, 'cols': {}}
+
+def add_point(state, field, ts, val, capacity=1024):
+    if field not in state['cols']:
+        state['cols'][field] = np.empty((capacity, 2))
+        state['n'][field] = 0
+    append_point(state, field, ts, val)
+
+def parse_iokernel_lines(state, lines):
+    # "<ts> Stats:" starts a record; the lines up to the next hold
+    # "<ts> NAME: count NAME: count ..." counts for the interval. Each count
+    # is also kept as NAME_PER_SEC, and RX_PULLED / BATCH_TOTAL as
+    # IOK_SATURATION. Anything before the first record is ignored.
+    for line in lines:
+        toks = line.split()
+        if len(toks) < 2:
+            continue
+        if toks[1] == "Stats:":
+            try:
+                tm = int(toks[0])
+            except ValueError:
+                state['malformed'] += 1
+                continue
+            state['in_record'] = True
+            state['rx_pulled'] = None
+            state['interval'] = tm - state['last_tm'] if state['last_tm'] is not None else None
+            state['last_tm'] = tm
+            continue
+        if not state['in_record'] or "eth stats for port" in line:
             continue
-        match = re.match(schedln_match, line)
-        if match:
-            ts = int(match.group(1))
-            stat_vec['rescheds'].append((ts, float(match.group(2))))
-            stat_vec['schedtimepct'].append((ts, float(match.group(3))))
-            stat_vec['localschedpct'].append((ts, float(match.group(4))))
-            stat_vec['softirqs'].append((ts, float(match.group(5))))
-            stat_vec['stolenirqpct'].append((ts, float(match.group(6))))
-            stat_vec['cpupct'].append((ts, float(match.group(7))))
-            stat_vec['parks'].append((ts, float(match.group(8))))
-            stat_vec['migratedpct'].append((ts, float(match.group(9))))
-            stat_vec['preempts'].append((ts, float(match.group(10))))
-            stat_vec['stolenpct'].append((ts, float(match.group(11))))
+        try:
+            tm = int(toks[0])
+            assert len(toks) % 2 == 1
+            assert all(name.endswith(":") for name in toks[1::2])
+            vals = [(name[:-1], int(val)) for name, val in zip(toks[1::2], toks[2::2])]
+        except (ValueError, AssertionError):
+            state['malformed'] += 1
             continue
-        assert False, line
-    return stat_vec
+        for name, val in vals:
+            add_point(state, name, tm, val)
+            if state['interval']:
+                add_point(state, name + "_PER_SEC", tm, val / float(state['interval']))
+            if name == "RX_PULLED":
+                state['rx_pulled'] = float(val)
+            elif name == "BATCH_TOTAL":
+                if state['rx_pulled'] is None:
+                    state['malformed'] += 1
+                elif val:
+                    add_point(state, 'IOK_SATURATION', tm, state['rx_pulled'] / float(val))
+
+def follow_iokernel(fname, state=None):
+    if state is None:
+        state = new_iokernel_state()
+    for lines in read_new_lines(fname, state):
+        parse_iokernel_lines(state, lines)
+    return state
 
-def extract_window(datapoints, wct_start, duration_sec):
+def parse_iokernel_log(dirn, experiment):
+    fname = "{dirn}/iokernel.{server_hostname}.log".format(
+        dirn=dirn, **experiment)
+    try:
+        state = follow_iokernel(fname)
+    except IOError:
+        return None
+    if state['malformed']:
+        print >>sys.stderr, "{}: skipped {} malformed lines".format(
+            fname, state['malformed'])
+    return point_columns(state) or None
+
+def time_series(datapoints):
+    # [(timestamp, value)...] -> (timestamps, contrib, prefix, nonfinite),
+    # sorted by time. contrib[i] is value[i] weighted by the gap since the
+    # previous report; prefix[i] sums the finite contribs up to i, so a
+    # window's gap-weighted mean is a difference of two prefix entries, and
+    # nonfinite[i] counts the NaN/Inf contribs up to i so window_means can
+    # tell when a window holds one.
+    pts = np.asarray(datapoints, dtype=float).reshape(-1, 2)
+    pts = pts[np.argsort(pts[:, 0], kind="mergesort")]
+    ts, vals = pts[:, 0], pts[:, 1]
+    contrib = np.zeros(len(ts))
+    contrib[1:] = vals[1:] * np.diff(ts)
+    finite = np.isfinite(contrib)
+    prefix = np.cumsum(np.where(finite, contrib, 0.))
+    nonfinite = np.cumsum(~finite)
+    return ts, contrib, prefix, nonfinite
+
+def window_means(series, wct_starts, duration_sec):
+    # Gap-weighted mean of series over the middle 10-90% of each window
+    # starting at wct_starts; None where fewer than two points fall inside.
+    ts, contrib, prefix, nonfinite = series
+    starts = np.asarray(wct_starts, dtype=float)
+    lo = np.searchsorted(ts, starts + int(duration_sec * 0.1), "left")
+    hi = np.searchsorted(ts, starts + int(duration_sec * 0.9), "right") - 1
+    means = []
+    for l, h in zip(lo.tolist(), hi.tolist()):
+        if h <= l or ts[h] == ts[l]:
+            means.append(None)
+        elif nonfinite[h] != nonfinite[l]:
+            # NaN/Inf only poison the windows that contain them
+            means.append(float(np.sum(contrib[l + 1:h + 1]) / (ts[h] - ts[l])))
+        else:
+            means.append(float((prefix[h] - prefix[l]) / (ts[h] - ts[l])))
+    return means
 
-    window_start = wct_start + int(duration_sec * 0.1)
-    window_end = wct_start + int(duration_sec * 0.9)
+def extract_window(series, wct_start, duration_sec):
+    return window_means(series, [wct_start], duration_sec)[0]
 
-    datapoints = filter(lambda l: l[0] >= window_start and l[
-        0] <= window_end, datapoints)
 
-    # Weight any gaps in reporting
+def load_clocks(dirname):
+    # host -> clock offset estimates from experiment.py (clocks.json);
+    # empty for runs made before they were recorded
     try:
-        total = 0
-        nsecs = 0
-        for idx, (tm, rate) in enumerate(datapoints[1:]):
-            nsec = tm - datapoints[idx][0]
-            total += rate * nsec
-            nsecs += nsec
-        avgmids = total / nsecs
-    except:
-        avgmids = None
-
-    return avgmids
-
+        with open(dirname + "/clocks.json") as f:
+            return json.loads(f.read())
+    except IOError:
+        return {}
+
+def clock_offset(clocks, host, t):
+    # seconds host's clock was ahead of the server's at time t, moving
+    # linearly from the start estimate by the measured drift
+    c = clocks.get(host)
+    if not c or 'start' not in c:
+        return 0.
+    return c['start']['offset'] + c.get('drift', 0.) * (t - c['start']['time'])
+
+def to_server_clock(points, clocks, host):
+    # (timestamp, value) rows taken on host, with timestamps moved onto
+    # the server's clock
+    if host not in clocks:
+        return points
+    pts = np.array(points, dtype=float).reshape(-1, 2)
+    pts[:, 0] -= clock_offset(clocks, host, pts[:, 0])
+    return pts
+
+def align_samples(samples, clocks, host):
+    # only the wall-clock start moves; tracepoint start times are relative
+    # to the client's own start and stay as they are
+    if host not in clocks:
+        return
+    for sample in samples:
+        sample['time'] -= clock_offset(clocks, host, sample['time'])
+
+def instance_app(experiment, inst):
+    # the server app a load generator instance measures
+    if inst['name'] == "localsynth":
+        return inst #local
+    server_handle = inst['name'].split(".")[1]
+    return next(app for app in experiment['apps'] if app['name'] == server_handle)
+
+def sample_columns(samples):
+    # One client's samples as flat arrays. Histograms and tracepoints are
+    # concatenated; sample i's are columns hist_start[i]:hist_start[i+1]
+    # (likewise trace_start) of the (2, k) hist and (2, n) trace arrays.
+    hists = [s['latencies'][0] for s in samples]
+    notrace = np.empty((2, 0), dtype=np.int64)
+    traces = [s.get('tracepoints', notrace) for s in samples]
+    cols = {
+        'time': np.array([s['time'] for s in samples], dtype=float),
+        'dropped': np.array([s['latencies'][1] for s in samples], dtype=np.int64),
+        'hist_start': np.cumsum([0] + [h.shape[1] for h in hists]).astype(np.int64),
+        'hist': np.hstack(hists) if hists else lat_hist([]),
+    }
+    for k in ['offered', 'achieved', 'missed']:
+        cols[k] = np.array([s[k] for s in samples], dtype=np.int64)
+    if any('tracepoints' in s for s in samples):
+        cols['trace_start'] = np.cumsum([0] + [t.shape[1] for t in traces]).astype(np.int64)
+        cols['trace'] = np.hstack(traces).astype(np.int64)
+    return cols
 
 def load_loadgen_results(experiment, dirname):
+    clocks = load_clocks(dirname)
     insts = [i for host in experiment['clients'] for i in experiment['clients'][host]]
     if not insts:
          insts = [i for i in experiment['apps'] if i.get('protocol') == 'synthetic'] # local synth;
@@ -322,29 +809,34 @@ def load_loadgen_results(experiment, dirname):
             filename = "{}/{}.out".format(dirname, inst['name'])
             assert os.access(filename, os.F_OK)
             data = parse_loadgen_output(filename)
+            align_samples(data, clocks, inst.get('host'))
+            # latencies are reduced to percentiles below; keep this
+            # client's histograms for the result store first
+            inst['columns'] = sample_columns(data)
            # assert len(data) == inst['samples'], filename
-            if inst['name'] != "localsynth":
-	            server_handle = inst['name'].split(".")[1] 
-        	    app = next(app for app in experiment['apps'] if app['name'] == server_handle)
-            else:
-                    app = inst #local
+            app = instance_app(experiment, inst)
+            app.setdefault('loadgen_clients', []).append(inst)
             if not 'loadgen' in app:
                 app['loadgen'] = data
             else:
                 app['loadgen'] = merge_sample_sets(app['loadgen'], data)
 
+    experiment['coverage'] = sample_coverage(experiment)
+    for name, (reported, expected) in sorted(experiment['coverage'].items()):
+        if reported < expected:
+            print >>sys.stderr, "{}: {} reported {}/{} samples".format(
+                dirname, name, reported, expected)
+
 
     for app in experiment['apps']:
         if not 'loadgen' in app: continue
         for sample in app['loadgen']:
-            latd = sample['latencies']
-            sample['p50'] = percentile(latd, 0.5)
-            sample['p90'] = percentile(latd, 0.9)
-            sample['p99'] = percentile(latd, 0.99)
-            sample['p999'] = percentile(latd, 0.999)
-            sample['p9999'] = percentile(latd, 0.9999)
+            (sample['p50'], sample['p90'], sample['p99'], sample['p999'],
+             sample['p9999']) = percentiles(sample['latencies'],
+                                            [0.5, 0.9, 0.99, 0.999, 0.9999])
             del sample['latencies']
             sample['app'] = app
+            sample['coverage'] = sample.get('clients', 1) / float(len(app['loadgen_clients']))
 
 def parse_dir(dirname):
     files = os.listdir(dirname)
@@ -355,13 +847,43 @@ def parse_dir(dirname):
     load_loadgen_results(experiment, dirname)
 
     start_time = min(sample['time'] for app in experiment['apps'] for sample in app.get('loadgen', []))
+    clocks = load_clocks(dirname)
+    observer = experiment.get('observer', experiment['server_hostname'])
 
+    # the (timestamp, value) points behind every series, for the store
+    series = experiment['series'] = {}
+    def points(name, pts):
+        series[name] = np.asarray(pts, dtype=float).reshape(-1, 2)
+        return time_series(series[name])
+
+    observed = parse_observer(dirname)
     for app in experiment['apps']:
         app['output'] = load_app_output(app, dirname, start_time)
-        app['rstat'] = parse_rstat(app, dirname)
+        if app['output']:
+            app['output']['recorded_samples'] = points("output/" + app['name'],
+                                                       app['output']['recorded_samples'])
+        if observed is not None:
+            app['rstat'] = observed.get(app['name'])
+        else:
+            app['rstat'] = parse_rstat(app, dirname)
+        if app['rstat']:
+            # rstat runs on the observer
+            app['rstat'] = {k: points("rstat/{}/{}".format(app['name'], k),
+                                      to_server_clock(v, clocks, observer))
+                            for k, v in app['rstat'].items()}
 
     experiment['mpstat'] = parse_utilization(dirname, experiment)
+    if experiment['mpstat']:
+        experiment['mpstat'] = {n: points("util/{}".format(n), v)
+                                for n, v in experiment['mpstat'].items()}
+    experiment['counters'] = parse_counters(dirname, experiment)
+    if experiment['counters']:
+        experiment['counters'] = {k: points("telemetry/" + k, v)
+                                  for k, v in experiment['counters'].items()}
     experiment['ioklog'] = parse_iokernel_log(dirname, experiment)
+    if experiment['ioklog']:
+        experiment['ioklog'] = {k: points("iokernel/" + k, v)
+                                for k, v in experiment['ioklog'].items()}
 
     return experiment
 
@@ -369,7 +891,10 @@ def arrange_2d_results(experiment):
     # per start time: the 1 background app of choice, aggregate throughtput,  
     # 1 line per start time per server application
 
-    by_time_point = zip(*(app['loadgen'] for app in experiment['apps'] if 'loadgen' in app))
+    # samples of different apps that started together, by start time; an
+    # app missing from a time point leaves it out of that point's rows
+    by_time_point = [[p for p in row if p is not None] for row in
+                     align_by_time([app['loadgen'] for app in experiment['apps'] if 'loadgen' in app])]
     bgs = [app for app in experiment['apps'] if app['output']]
     # TODO support multiple bg apps
     assert len(bgs) <= 1
@@ -380,7 +905,8 @@ def arrange_2d_results(experiment):
     header1 = ["system", "app", "background", "transport", "spin", "nconns", "threads"]
     header2 = ["offered", "achieved", "p50", "p90", "p99", "p999", "p9999", "distribution"]
     header3 = ["tput", "baseline", "totaloffered", "totalachieved",
-              "totalcpu"] #, "localcpu", "ioksaturation"]
+              "totalcpu", "nodes", "nodecpu", "efficiency", "coverage",
+              "ctxtpersec", "softirqpersec"] #, "localcpu", "ioksaturation"]
 
     header = header1 + header2 + header3 + DISPLAYED_RSTAT_FIELDS
 
@@ -390,33 +916,56 @@ def arrange_2d_results(experiment):
         for i in list_pm: ncons += i['client_threads']
 #    nconns = sum(
 
-    for time_point in by_time_point:
-        times = set(t['time'] for t in time_point)
-        #assert len(times) == 1 # all start times are the same
-        time = times.pop()
-	if len(times) == 1: assert abs(times.pop() - time) <= 1
-	else: assert len(times) == 0
+    time_points = [(min(t['time'] for t in time_point), time_point)
+                   for time_point in by_time_point]
+
+    # every windowed series, for all time points at once
+    starts = [time for time, _ in time_points]
+    nopoints = [None] * len(starts)
+    bgtputs = window_means(bg['output']['recorded_samples'], starts, runtime) if bg else nopoints
+    all_nodes = experiment_nodes(experiment)
+    node_sets = set(tuple(app.get('numa_nodes', all_nodes)) for app in experiment['apps'])
+    node_cpus = {}
+    for nodes in node_sets | set([tuple(all_nodes)]):
+        node_cpus[nodes] = utilization_windows(experiment['mpstat'], experiment, nodes,
+                                               starts, runtime) if experiment['mpstat'] else nopoints
+    cpus = node_cpus[tuple(all_nodes)]
+    counters = {}
+    for k in ['ctxt', 'softirq']:
+        counters[k] = window_means(experiment['counters'][k], starts, runtime) \
+            if experiment['counters'] else nopoints
+    rstat_windows = {}
+    for app in experiment['apps']:
+        if app['rstat']:
+            rstat_windows[app['name']] = {
+                field: window_means(app['rstat'][field], starts, runtime)
+                for field in DISPLAYED_RSTAT_FIELDS}
+
+    for i, (time, time_point) in enumerate(time_points):
         bgbaseline = bg['output']['recorded_baseline'] if bg else 0
-        bgtput = extract_window(bg['output']['recorded_samples'], time, runtime) if bg else 0
-	if bgtput is None: bgtput = 0
-        cpu = extract_window(experiment['mpstat'], time, runtime) if experiment['mpstat'] else None
+        bgtput = bgtputs[i] if bgtputs[i] is not None else 0
+        cpu = cpus[i]
         total_offered = sum(t['offered'] for t in time_point)
         total_achieved = sum(t['achieved'] for t in time_point)
-        iok_saturation = extract_window(experiment['ioklog']['IOK_SATURATION'], time, runtime) if experiment['ioklog'] else None
         for point in time_point:
             out = [experiment['system'], point['app']['app'], bg['app'] if bg else None, point['app'].get('transport', None), point['app']['spin'] > 1, ncons, point['app']['threads']]
             out += [point[k] for k in header2]
             out += [bgtput, bgbaseline, total_offered, total_achieved, cpu]
+            nodes = tuple(point['app'].get('numa_nodes', all_nodes))
+            nodecpu = node_cpus[nodes][i]
+            out += ["+".join(str(n) for n in nodes), nodecpu,
+                    efficiency(point['achieved'], nodecpu, experiment, nodes),
+                    point['coverage'], counters['ctxt'][i], counters['softirq'][i]]
             """if point['app']['rstat']:
                 out.append(extract_window(point['app']['rstat']['cpupct'], time, runtime))
             else:
                 out.append(None)
             out.append(iok_saturation)"""
             for field in DISPLAYED_RSTAT_FIELDS:
-		if point['app']['rstat']:
-			out.append(extract_window(point['app']['rstat'][field], time, runtime))
-		else:
-			out.append(None)
+                if point['app']['rstat']:
+                    out.append(rstat_windows[point['app']['name']][field][i])
+                else:
+                    out.append(None)
             lines.append(out)
         for bgl in bgs:
             continue; out = [experiment['system'], bgl['app'], bg['app'] if bg else None, 
@@ -424,7 +973,7 @@ def arrange_2d_results(experiment):
             out += [0]*7 + [None]
             out.append(extract_window(bgl['output']['recorded_samples'], time, runtime))
             out.append(bgl['output']['recorded_baseline'])
-            out += [total_offered, total_achieved, cpu]
+            out += [total_offered, total_achieved, cpu, None, None, None, None, None, None]
             """if bgl['rstat']:
                 out.append(extract_window(bgl['rstat']['cpupct'], time, runtime))
             else:
@@ -453,7 +1002,7 @@ def print_res(res):
     for line in res:
         print ",".join([str(x) for x in line])
 
-def do_it_all(dirname):
+def do_it_all(dirname, verbose=True):
 
     exp = parse_dir(dirname)
     stats = arrange_2d_results(exp)
@@ -466,15 +1015,313 @@ def do_it_all(dirname):
     with open(STAT_F + "stat.csv", "w") as f:
         for line in stats:
             x = ",".join([str(x) for x in line])
-            print x
+            if verbose: print x
             f.write(x + '\n')
 
+    write_run_columns(dirname, exp)
     return bycol
 
+# Result store: each run's client histograms, tracepoints and server
+# series go to <run>/stats/columns.bin, 8-byte aligned so every column can
+# be np.memmap'd on its own. stats/columns.json describes the file along
+# with the run's config.json, and main() appends that record to the store
+# index (one JSON line per run; a later line for a path replaces earlier).
+
+def write_columns(fname, arrays):
+    # {name: array} -> {name: [offset, dtype, shape]}
+    layout = {}
+    with open(fname + ".tmp", "wb") as f:
+        for name in sorted(arrays):
+            a = np.ascontiguousarray(arrays[name])
+            f.write("\0" * (-f.tell() % 8))
+            layout[name] = [f.tell(), a.dtype.str, list(a.shape)]
+            f.write(a.tobytes())
+    os.rename(fname + ".tmp", fname)
+    return layout
+
+def write_run_columns(dirname, experiment):
+    arrays = dict(experiment['series'])
+    for insts in experiment['clients'].values():
+        for inst in insts:
+            for k, v in inst.get('columns', {}).items():
+                arrays["loadgen/{}/{}".format(inst['name'], k)] = v
+    with open(dirname + "/config.json") as f:
+        config = json.loads(f.read())
+    data = os.path.abspath(dirname + "/stats/columns.bin")
+    record = {'data': data, 'layout': write_columns(data, arrays), 'config': config}
+    with open(dirname + "/stats/columns.json", "w") as f:
+        f.write(json.dumps(record))
+
+def load_store(path):
+    # the latest record of each run in the store index, in the order runs
+    # were first added
+    runs = {}
+    order = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record['path'] not in runs:
+                order.append(record['path'])
+            runs[record['path']] = record
+    return [runs[p] for p in order]
+
+def select_runs(records, **params):
+    # records whose config.json has the given top-level values, ie
+    # select_runs(load_store(path), system="shenango")
+    return [r for r in records
+            if all(r['config'].get(k) == v for k, v in params.items())]
+
+def open_column(record, name):
+    offset, dtype, shape = record['layout'][name]
+    if not all(shape):
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(record['data'], dtype=dtype, mode="r",
+                     offset=offset, shape=tuple(shape))
+
+def client_latencies(record, inst, idx):
+    # (latency histogram, number_dropped) of one client's sample idx, as
+    # taken by percentiles() and merge_lat()
+    col = lambda k: open_column(record, "loadgen/{}/{}".format(inst, k))
+    begin, end = col('hist_start')[idx:idx + 2]
+    return np.array(col('hist')[:, begin:end]), int(col('dropped')[idx])
+
+# Files written by the summary itself, which must not make a run look stale
+DERIVED_SUFFIXES = (".trace.npy", ".trace.lines", ".tmp")
+
+def run_mtime(dirname):
+    # newest raw file; not the directory's own mtime, which changes when
+    # the summary adds stats/ and the trace caches
+    return max([0] + [
+        os.stat("{}/{}".format(dirname, f)).st_mtime
+        for f in os.listdir(dirname)
+        if f != "stats" and not f.endswith(DERIVED_SUFFIXES)])
+
+def open_index(path):
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE IF NOT EXISTS runs "
+               "(path TEXT PRIMARY KEY, mtime REAL, csv TEXT)")
+    return db
+
+def summarize_dir(dirname):
+    # pool worker: returns (dirname, csv text or None, store record, error)
+    try:
+        do_it_all(dirname, verbose=False)
+        with open("{}/stats/stat.csv".format(dirname)) as f:
+            csv = f.read()
+        with open("{}/stats/columns.json".format(dirname)) as f:
+            return dirname, csv, json.loads(f.read()), None
+    except Exception as e:
+        return dirname, None, None, "{}: {}".format(type(e).__name__, e)
+
+# --follow gives up on a client whose output has not grown for a sample's
+# runtime plus this many seconds, and prints its app's rows without it
+FOLLOW_SLACK = 30
+
+def follow(dirname, interval=1.0):
+    # Live view of a run that is still in progress: tail the client
+    # outputs (which experiment.py streams into dirname as they grow) and
+    # the server logs, and print a row for each sample as soon as every
+    # client of its app has reported it, moved past its start time or been
+    # given up on. Returns once every client is done: it has reported all
+    # its samples, or its output stopped growing.
+    conf_fn = dirname + "/config.json"
+    while not os.access(conf_fn, os.F_OK):
+        time.sleep(interval)
+    with open(conf_fn) as f:
+        experiment = json.loads(f.read())
+
+    insts = [i for host in experiment['clients'] for i in experiment['clients'][host]]
+    if not insts:
+        insts = [i for i in experiment['apps'] if i.get('protocol') == 'synthetic'] # local synth
+    runtime = insts[0]['runtime']
+    by_app = defaultdict(list)
+    for inst in insts:
+        by_app[instance_app(experiment, inst)['name']].append(inst)
+    outputs = {inst['name']: new_loadgen_state() for inst in insts}
+    # per client, when its output last grew and how many of its samples
+    # are in rows already printed
+    grew = {inst['name']: None for inst in insts}
+    consumed = {inst['name']: 0 for inst in insts}
+    done = set()
+    rstats = {app: new_rstat_state() for app in by_app}
+    observed = new_observer_state()
+    # by path, as the server logs move from the session into dirname
+    iokernels = defaultdict(new_iokernel_state)
+    mpstats = defaultdict(new_utilization_state)
+    observer = experiment.get('observer', experiment['server_hostname'])
+
+    header = ["time", "app", "offered", "achieved", "p50", "p99", "p999",
+              "totalcpu", "ioksaturation"] + DISPLAYED_RSTAT_FIELDS + ["coverage"]
+    print ",".join(header)
+    sys.stdout.flush()
+
+    def tail(fname, fn, state):
+        if os.access(fname, os.F_OK):
+            fn(fname, state)
+
+    def server_log(name):
+        # in a session (experiment.py's run_session) the server's logs stay
+        # in the session directory until the run ends
+        for d in [dirname, experiment.get('session_dir')]:
+            if d and os.access("{}/{}".format(d, name), os.F_OK):
+                return "{}/{}".format(d, name)
+        return None
+
+    while True:
+        now = time.time()
+        for inst in insts:
+            state = outputs[inst['name']]
+            fname = "{}/{}.out".format(dirname, inst['name'])
+            if inst['name'] in done or not os.access(fname, os.F_OK):
+                continue
+            offset = state['offset']
+            for lines in read_new_lines(fname, state):
+                parse_loadgen_lines(state, lines)
+            if state['offset'] != offset:
+                grew[inst['name']] = now
+        # clients start together, so one that has never written anything
+        # is timed from the first output of any
+        started = [t for t in grew.values() if t is not None]
+        for inst in insts:
+            name = inst['name']
+            nsamples = len(outputs[name]['samples'])
+            if name in done:
+                continue
+            if inst.get('samples', 0) and nsamples >= inst['samples']:
+                done.add(name)
+            elif started and now - (grew[name] or min(started)) > runtime + FOLLOW_SLACK:
+                print >>sys.stderr, "{}: {} stopped after {} samples".format(dirname, name, nsamples)
+                done.add(name)
+
+        if os.access(dirname + "/rstat.jsonl", os.F_OK):
+            follow_observer(dirname + "/rstat.jsonl", observed)
+            rstats = observed['names']
+        else:
+            for app in by_app:
+                tail("{}/rstat.{}.log".format(dirname, app), follow_rstat, rstats[app])
+        iok = server_log("iokernel.{}.log".format(experiment['server_hostname']))
+        ioklog = point_columns(follow_iokernel(iok, iokernels[iok])) if iok else {}
+
+        clocks = load_clocks(dirname)
+        pending = []
+        for app, app_insts in by_app.items():
+            waiting = [i for i in app_insts if i['name'] not in done]
+            if not all(outputs[i['name']]['samples'] for i in waiting):
+                continue
+            # a start time is complete once every client still running has
+            # reported a sample for it or moved past it
+            latest = []
+            for inst in waiting:
+                last = dict(outputs[inst['name']]['samples'][-1])
+                align_samples([last], clocks, inst.get('host'))
+                latest.append(last['time'])
+            sample_sets = []
+            for inst in app_insts:
+                # only samples not yet printed are aligned and merged
+                samples = outputs[inst['name']]['samples']
+                parts = [dict(sample) for sample in samples[consumed[inst['name']]:]]
+                for part in parts:
+                    part.pop('tracepoints', None)
+                align_samples(parts, clocks, inst.get('host'))
+                sample_sets.append(parts)
+            rows = align_by_time(sample_sets)
+            if latest:
+                rows = [row for row in rows
+                        if min(p['time'] for p in row if p is not None) <= min(latest)]
+            for i, inst in enumerate(app_insts):
+                consumed[inst['name']] += sum(1 for row in rows if row[i] is not None)
+            pending += [(app, app_insts, merge_samples([p for p in row if p is not None]))
+                        for row in rows]
+
+        util = {}
+        if pending:
+            # utilization only over the windows about to be printed
+            since = min(sample['time'] for _, _, sample in pending)
+            tel = server_log("telemetry.{}.bin".format(experiment['server_hostname']))
+            mp = server_log("mpstat.{}.log".format(experiment['server_hostname']))
+            if tel:
+                util = telemetry_utilization(read_telemetry(tel, since))
+            elif mp:
+                util = follow_utilization(mp, mpstats[mp])['nodes']
+        for app, app_insts, sample in pending:
+            rstat = {k: time_series(to_server_clock(v, clocks, observer))
+                     for k, v in point_columns(rstats[app]).items()}
+            p50, p99, p999 = percentiles(sample['latencies'], [0.5, 0.99, 0.999])
+            t = sample['time']
+            out = [t, app, sample['offered'], sample['achieved'], p50, p99, p999]
+            nodes = instance_app(experiment, app_insts[0]).get('numa_nodes', experiment_nodes(experiment))
+            out.append(utilization_windows({n: time_series(v) for n, v in util.items() if len(v)},
+                                           experiment, nodes, [t], runtime)[0])
+            if len(ioklog.get('IOK_SATURATION', [])):
+                out.append(extract_window(time_series(ioklog['IOK_SATURATION']), t, runtime))
+            else:
+                out.append(None)
+            out += [extract_window(rstat[field], t, runtime) for field in DISPLAYED_RSTAT_FIELDS]
+            out.append(sample['clients'] / float(len(app_insts)))
+            print ",".join(str(x) for x in out)
+        sys.stdout.flush()
+
+        if len(done) == len(insts):
+            return
+        time.sleep(interval)
+
 def main():
-    all_res = []
-    for d in sys.argv[1:]:
-        do_it_all(d)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dirs", nargs="*")
+    parser.add_argument("--follow", metavar="DIR",
+                        help="print samples of a running experiment as they land")
+    parser.add_argument("--interval", type=float, default=1.0,
+                        help="polling interval for --follow, in seconds")
+    parser.add_argument("--index", default=".summary_index.sqlite",
+                        help="results index used to skip unchanged runs")
+    parser.add_argument("--store", default=".summary_store.jsonl",
+                        help="result store index that each summarized run is appended to")
+    parser.add_argument("--force", action="store_true",
+                        help="re-summarize runs even if they are unchanged")
+    parser.add_argument("-j", "--jobs", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.follow:
+        follow(args.follow, args.interval)
+        return
+    if not args.dirs:
+        parser.error("no result directories given")
+
+    db = open_index(args.index)
+    stored = {}
+    if os.access(args.store, os.F_OK):
+        stored = {r['path']: r['mtime'] for r in load_store(args.store)}
+    mtimes = {}
+    todo = []
+    for d in args.dirs:
+        d = os.path.abspath(d)
+        mtimes[d] = run_mtime(d)
+        row = db.execute("SELECT mtime, csv FROM runs WHERE path = ?", (d,)).fetchone()
+        if row and row[0] == mtimes[d] == stored.get(d) and not args.force:
+            sys.stdout.write(row[1])
+        else:
+            todo.append(d)
+
+    if not todo:
+        return
+    p = Pool(args.jobs)
+    store = open(args.store, "a")
+    for d, csv, record, err in p.imap(summarize_dir, todo):
+        if err:
+            print >>sys.stderr, "{}: {}".format(d, err)
+            continue
+        sys.stdout.write(csv)
+        record['path'] = d
+        record['mtime'] = mtimes[d]
+        store.write(json.dumps(record) + "\n")
+        store.flush()
+        db.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?)", (d, mtimes[d], csv))
+        db.commit()
+    store.close()
+    p.close()
+    p.join()
 
 if __name__ == '__main__':
     main()